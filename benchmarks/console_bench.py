@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# console_bench.py -- End-to-end benchmarks of the console widget
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Runs SMLConsole in a window on a virtual X server, talking to
+fakesml.py, and times what a user would notice:
+
+    output      lines per second shown from one large evaluation
+    keystroke   time from a key press to its character in the buffer,
+                with redraws done
+    evaluate    time from Return to the next prompt being shown
+    reload-N    Ctrl+R on an N line document until the last answer
+                is shown, with the document and each binding echoed
+    reload-quiet-N
+                the same with only errors and a summary shown, which
+                fails unless the summary reports every declaration
+    restart     time from an interpreter crash to the next prompt
+
+Each benchmark is run --repeat times and the median is reported, along
+with the peak memory of the console. Results can be saved with --json
+and compared against an earlier run with --compare:
+
+    python benchmarks/console_bench.py --json before.json
+    python benchmarks/console_bench.py --compare before.json
+
+fakesml.py is run as `mosml', so that quiet reloads turn off the
+bindings with Meta.quietdec as they would with the real interpreter.
+An Xvfb server is started unless --display is given. Needs pygtk.
+"""
+
+import json
+import optparse
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'smlconsole'))
+
+RELOAD_SIZES = (1000, 10000, 100000)
+OUTPUT_LINES = 100000
+KEYSTROKES = 200
+
+class Timeout(Exception):
+    pass
+
+def start_xvfb():
+    """Starts Xvfb on the first free display and returns it."""
+    for number in range(99, 199):
+        if os.path.exists('/tmp/.X%d-lock' % number):
+            continue
+        display = ':%d' % number
+        proc = subprocess.Popen(['Xvfb', display, '-screen', '0', '1024x768x24', '-nolisten', 'tcp'],
+                                stdout = open(os.devnull, 'w'), stderr = subprocess.STDOUT)
+        for i in range(50):
+            if os.path.exists('/tmp/.X11-unix/X%d' % number):
+                return proc, display
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        if proc.poll() is None:
+            proc.kill()
+    raise RuntimeError('could not start Xvfb')
+
+class Document(object):
+    """Enough of a gedit document for SMLConsole.reload_document."""
+
+    def __init__(self, gtk, text):
+        self.buffer = gtk.TextBuffer()
+        self.buffer.set_text(text)
+
+    def get_uri(self):
+        return None
+
+    def get_short_name_for_display(self):
+        return 'bench.sml'
+
+    def get_start_iter(self):
+        return self.buffer.get_start_iter()
+
+    def get_end_iter(self):
+        return self.buffer.get_end_iter()
+
+    def get_text(self, start, end):
+        return self.buffer.get_text(start, end)
+
+class Window(object):
+    def __init__(self):
+        self.document = None
+
+    def get_active_document(self):
+        return self.document
+
+class Bench(object):
+    def __init__(self, command, timeout):
+        import gobject
+        import gtk
+        from console import SMLConsole
+        from session import Session
+
+        self.gobject = gobject
+        self.gtk = gtk
+        self.timeout = timeout
+
+        # The console reads its command line from the preferences.
+        Session.command = staticmethod(lambda config = None: (command, 'pipe'))
+        self.window = Window()
+        self.console = SMLConsole(namespace = {'window': self.window, 'datadir': HERE})
+        self.toplevel = gtk.Window()
+        self.toplevel.set_default_size(800, 600)
+        self.toplevel.add(self.console)
+        self.toplevel.show_all()
+        self.console.grab_focus()
+        self.wait(self.idle)
+
+    def close(self):
+        self.console.stop()
+        self.toplevel.destroy()
+
+    def idle(self):
+        session = self.console.session
+        return session.sml is not None and session.requests.ready and \
+               not session.requests.busy and not self.console.output.pending
+
+    def wait(self, condition):
+        # A ticker keeps main_iteration from blocking while waiting on a
+        # condition no event will announce.
+        gtk = self.gtk
+        ticker = self.gobject.timeout_add(5, lambda: True)
+        deadline = time.time() + self.timeout
+        try:
+            while not condition():
+                if time.time() > deadline:
+                    raise Timeout()
+                gtk.main_iteration(True)
+            while gtk.events_pending():
+                gtk.main_iteration(False)
+        finally:
+            self.gobject.source_remove(ticker)
+
+    def key(self, keyval, state = 0):
+        gtk = self.gtk
+        event = gtk.gdk.Event(gtk.gdk.KEY_PRESS)
+        event.window = self.console.view.window
+        event.keyval = keyval
+        event.state = state
+        event.time = int(time.time() * 1000) & 0xffffffff
+        entries = gtk.gdk.keymap_get_default().get_entries_for_keyval(keyval)
+        if entries:
+            event.hardware_keycode = entries[0][0]
+        code = gtk.gdk.keyval_to_unicode(keyval)
+        if code and not state:
+            event.string = unichr(code).encode('utf-8')
+        self.console.view.emit('key-press-event', event)
+
+    def type(self, text):
+        for c in text:
+            self.key(self.gtk.gdk.unicode_to_keyval(ord(c)))
+
+    def evaluate(self, phrase):
+        start = time.time()
+        self.console.set_command_line(phrase)
+        self.key(self.gtk.keysyms.Return)
+        self.wait(self.idle)
+        return time.time() - start
+
+    def bench_output(self, lines = OUTPUT_LINES):
+        return lines / self.evaluate('fake_output %d;' % lines)
+
+    def bench_keystroke(self, count = KEYSTROKES):
+        buffer = self.console.view.get_buffer()
+        times = []
+        for i in range(count):
+            length = buffer.get_char_count()
+            start = time.time()
+            self.key(self.gtk.keysyms.a)
+            self.wait(lambda: buffer.get_char_count() > length)
+            times.append(time.time() - start)
+        self.console.set_command_line('')
+        return median(times)
+
+    def bench_evaluate(self, count = 20):
+        return median([self.evaluate('%d + 1;' % i) for i in range(count)])
+
+    def bench_reload(self, lines, quiet):
+        self.console.quiet_reload = quiet
+        self.window.document = Document(self.gtk, ''.join(['val x%d = %d;\n' % (i, i)
+                                                           for i in range(lines)]))
+        buffer = self.console.view.get_buffer()
+        mark = buffer.create_mark(None, buffer.get_end_iter(), True)
+        start = time.time()
+        self.key(self.gtk.keysyms.r, self.gtk.gdk.CONTROL_MASK | self.gtk.gdk.SHIFT_MASK)
+        self.wait(self.idle)
+        elapsed = time.time() - start
+        shown = buffer.get_text(buffer.get_iter_at_mark(mark), buffer.get_end_iter())
+        buffer.delete_mark(mark)
+        if quiet and '(* Loaded %d declarations in ' % lines not in shown:
+            raise RuntimeError('the quiet reload did not finish: %r' % shown[-200:])
+        return elapsed
+
+    def bench_restart(self):
+        old = self.console.session.sml
+        start = time.time()
+        self.console.set_command_line('fake_crash;')
+        self.key(self.gtk.keysyms.Return)
+        self.wait(lambda: self.console.session.sml is not old and self.idle())
+        return time.time() - start
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def peak_memory():
+    """Peak resident size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024)
+    return peak / 1024.0
+
+def run(options, command):
+    benchmarks = [
+        ('output', 'lines/s', lambda bench: bench.bench_output(options.output_lines)),
+        ('keystroke', 'ms', lambda bench: bench.bench_keystroke() * 1000),
+        ('evaluate', 'ms', lambda bench: bench.bench_evaluate() * 1000),
+    ] + [
+        ('reload-%d' % n, 'ms', lambda bench, n = n: bench.bench_reload(n, False) * 1000)
+        for n in options.reload_sizes
+    ] + [
+        ('reload-quiet-%d' % n, 'ms', lambda bench, n = n: bench.bench_reload(n, True) * 1000)
+        for n in options.reload_sizes
+    ] + [
+        ('restart', 'ms', lambda bench: bench.bench_restart() * 1000),
+    ]
+
+    results = {}
+    bench = Bench(command, options.timeout)
+    try:
+        for (name, unit, measure) in benchmarks:
+            if options.only and name not in options.only:
+                continue
+            samples = []
+            for i in range(options.repeat):
+                try:
+                    samples.append(measure(bench))
+                except Timeout:
+                    break
+            if samples:
+                results[name] = {'unit': unit, 'median': median(samples),
+                                 'min': min(samples), 'max': max(samples),
+                                 'samples': samples}
+            else:
+                results[name] = {'unit': unit, 'timeout': options.timeout}
+    finally:
+        bench.close()
+    results['peak-memory'] = {'unit': 'MB', 'median': peak_memory()}
+    return results
+
+def report(results, baseline = None):
+    for name in sorted(results):
+        result = results[name]
+        line = '%-14s' % name
+        if 'median' not in result:
+            print('%s timed out after %.0f s' % (line, result['timeout']))
+            continue
+        line += ' %12.2f %-8s' % (result['median'], result['unit'])
+        if 'min' in result:
+            line += ' (min %.2f, max %.2f)' % (result['min'], result['max'])
+        old = baseline and baseline.get(name, {}).get('median')
+        if old:
+            line += '  %+6.1f%%' % ((result['median'] - old) * 100.0 / old)
+        print(line)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--display', help = 'use this X display instead of starting Xvfb')
+    parser.add_option('--repeat', type = 'int', default = 5)
+    parser.add_option('--timeout', type = 'float', default = 120.0)
+    parser.add_option('--output-lines', type = 'int', default = OUTPUT_LINES)
+    parser.add_option('--reload-sizes', default = ','.join(map(str, RELOAD_SIZES)),
+                      help = 'document sizes in lines for the Ctrl+R benchmark')
+    parser.add_option('--only', action = 'append',
+                      help = 'run only this benchmark; may be repeated')
+    parser.add_option('--buffering', choices = ['flush', 'block'], default = 'flush',
+                      help = 'output buffering of the stand-in interpreter')
+    parser.add_option('--json', help = 'save the results to this file')
+    parser.add_option('--compare', help = 'compare with results saved by --json')
+    options, args = parser.parse_args()
+    options.reload_sizes = [int(n) for n in options.reload_sizes.split(',') if n]
+
+    bindir = tempfile.mkdtemp(prefix = 'smlconsole-bench-')
+    command = [os.path.join(bindir, 'mosml'), '--buffering', options.buffering]
+    f = open(command[0], 'w')
+    try:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.join(HERE, 'fakesml.py')))
+    finally:
+        f.close()
+    os.chmod(command[0], 0o755)
+
+    xvfb = None
+    if options.display:
+        os.environ['DISPLAY'] = options.display
+    else:
+        xvfb, os.environ['DISPLAY'] = start_xvfb()
+    try:
+        results = run(options, command)
+    finally:
+        if xvfb is not None:
+            xvfb.kill()
+            xvfb.wait()
+        shutil.rmtree(bindir, ignore_errors = True)
+
+    baseline = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)['results']
+        finally:
+            f.close()
+    report(results, baseline)
+
+    if options.json:
+        f = open(options.json, 'w')
+        try:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'options': {'repeat': options.repeat,
+                                   'output-lines': options.output_lines,
+                                   'buffering': options.buffering},
+                       'results': results}, f, indent = 2, sort_keys = True)
+        finally:
+            f.close()
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
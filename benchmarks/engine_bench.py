@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# engine_bench.py -- Many interpreter sessions on one asyncio loop
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Drives --sessions interpreter sessions at once through the session
+engine, without a display, and reports the evaluations per second and
+the latency of each, along with the time to start them all:
+
+    python3 benchmarks/engine_bench.py --sessions 16 --evaluations 500
+    python3 benchmarks/engine_bench.py --interpreter mosml -- -P full
+
+Needs Python 3.
+"""
+
+import asyncio
+import optparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'smlconsole'))
+from aiosession import AsyncSession
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def drive(session, evaluations, latencies):
+    for i in range(evaluations):
+        request = await session.submit('%d + 1;\n' % i)
+        if request.aborted:
+            raise RuntimeError('the interpreter exited')
+        latencies.append(request.latency)
+
+async def run(options, command):
+    start = time.time()
+    sessions = [AsyncSession((command, options.transport)) for i in range(options.sessions)]
+    try:
+        if not all(await asyncio.gather(*[session.ready() for session in sessions])):
+            raise RuntimeError('an interpreter did not start')
+        startup = time.time() - start
+
+        latencies = []
+        start = time.time()
+        await asyncio.gather(*[drive(session, options.evaluations, latencies)
+                               for session in sessions])
+        elapsed = time.time() - start
+    finally:
+        for session in sessions:
+            session.close()
+
+    print('%d sessions started in %.1f ms' % (options.sessions, startup * 1000))
+    print('%d evaluations in %.2f s: %.0f/s' % (len(latencies), elapsed, len(latencies) / elapsed))
+    print('latency p50 %.3f ms, p95 %.3f ms, max %.3f ms' %
+          (percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000,
+           max(latencies) * 1000))
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sessions', type = 'int', default = 8)
+    parser.add_option('--evaluations', type = 'int', default = 200,
+                      help = 'evaluations per session, one after another')
+    parser.add_option('--transport', choices = ['pipe', 'pty'], default = 'pipe')
+    parser.add_option('--interpreter', help = 'run this instead of fakesml.py')
+    options, args = parser.parse_args()
+
+    if options.interpreter:
+        command = [options.interpreter] + args
+    else:
+        command = [sys.executable, os.path.join(HERE, 'fakesml.py')]
+    asyncio.run(run(options, command))
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# fakesml.py -- Stand-in SML interpreter for benchmarks
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Talks like mosml: prints a banner and a "- " prompt, reads phrases
+terminated by ';', answers each with a binding, and prompts "= " for
+continuation lines.
+
+With --buffering=block, output is only flushed when stdout is a
+terminal, or otherwise every --flush-interval seconds, the way many
+runtimes block-buffer output on a pipe.
+
+A few phrases are scripts rather than expressions, for the benchmarks:
+
+    fake_output N;    prints N lines of 80 characters
+    fake_sleep S;     takes S seconds to answer
+    fake_hang S;      takes S seconds to answer, and ignores interrupts
+    fake_crash;       exits with status 2, as an interpreter crash would
+
+As in mosml, Meta.quietdec := true; stops the bindings being printed,
+and Meta.quietdec := false; starts it again.
+
+SIGINT aborts the phrase being answered, and prompts again.
+"""
+
+import optparse
+import os
+import re
+import signal
+import threading
+import time
+
+BLOCK_SIZE = 8192
+
+class Output(object):
+    """Writes straight to fd 1, so that buffering is entirely ours and
+    not whatever the Python runtime does on a pipe."""
+
+    def __init__(self, flush_always, interval):
+        self.buffer = []
+        self.flush_always = flush_always
+        self.lock = threading.Lock()
+        if not flush_always and interval > 0:
+            t = threading.Thread(target = self.flusher, args = (interval,))
+            t.daemon = True
+            t.start()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer.append(text.encode('utf-8'))
+            if self.flush_always or sum(map(len, self.buffer)) >= BLOCK_SIZE:
+                self.flush()
+
+    def flush(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        while data:
+            data = data[os.write(1, data):]
+
+    def flusher(self, interval):
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                self.flush()
+
+def lines():
+    pending = b''
+    while True:
+        data = os.read(0, 65536)
+        if not data:
+            if pending:
+                yield pending
+            return
+        pending += data
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            yield line + b'\n'
+
+SCRIPT = re.compile(r'^fake_(output|sleep|hang|crash)\s*([0-9.]*)$')
+QUIETDEC = re.compile(r'^Meta\.quietdec\s*:=\s*(true|false)$')
+LINE = u'%s\n' % (u'x' * 79)
+
+class State(object):
+    quiet = False
+
+def binding(out, text, type):
+    if State.quiet:
+        out.write(u'- ')
+    else:
+        out.write(u'> val it = %s : %s\n- ' % (text, type))
+
+def answer(out, text):
+    m = QUIETDEC.match(text)
+    if m is not None:
+        State.quiet = m.group(1) == 'true'
+        binding(out, u'()', u'unit')
+        return
+    m = SCRIPT.match(text)
+    if m is None:
+        binding(out, text, u'int')
+        return
+    command, argument = m.groups()
+    if command == 'output':
+        count = int(argument or 0)
+        while count > 0:
+            out.write(LINE * min(count, 1000))
+            count -= 1000
+        binding(out, u'()', u'unit')
+    elif command == 'sleep':
+        time.sleep(float(argument or 0))
+        binding(out, u'()', u'unit')
+    elif command == 'hang':
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        time.sleep(float(argument or 0))
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        binding(out, u'()', u'unit')
+    else:
+        out.flush()
+        os._exit(2)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--buffering', choices = ['flush', 'block'], default = 'flush')
+    parser.add_option('--flush-interval', type = 'float', default = 0.2)
+    parser.add_option('--startup-delay', type = 'float', default = 0.0)
+    options, args = parser.parse_args()
+
+    out = Output(options.buffering == 'flush' or os.isatty(1), options.flush_interval)
+    time.sleep(options.startup_delay)
+
+    out.write(u'Moscow ML version 2.01 (January 2004)\n'
+              u'Enter `quit();\' to quit.\n- ')
+    phrase = []
+    for line in lines():
+        line = line.decode('utf-8', 'replace')
+        phrase.append(line)
+        if ';' not in line:
+            out.write(u'= ')
+            continue
+        text = u''.join(phrase).strip().rstrip(u';')
+        phrase = []
+        try:
+            answer(out, text)
+        except KeyboardInterrupt:
+            out.write(u'! Uncaught exception:\n! Interrupt\n- ')
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
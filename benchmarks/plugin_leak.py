@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# plugin_leak.py -- Checks that deactivating the plugin releases everything
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Activates the plugin in a window, waits for its interpreter (here
+fakesml.py) to start, and deactivates it again, --cycles times. After
+--warmup cycles, and again at the end, it measures:
+
+    sources     timeouts, watches and idle callbacks still registered
+    handlers    preference change handlers
+    objects     consoles and sessions not yet garbage collected
+    fds         open file descriptors
+    wakeups     callbacks run in --idle seconds of doing nothing
+    memory      resident size
+
+and fails unless all of them stay flat, memory within --max-growth MB.
+
+    python benchmarks/plugin_leak.py --cycles 2000
+
+Preferences and history go to a temporary directory. An Xvfb server is
+started unless --display is given. Needs pygtk.
+"""
+
+import gc
+import imp
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN = os.path.join(HERE, '..', 'smlconsole')
+sys.path.insert(0, PLUGIN)
+
+from console_bench import start_xvfb
+
+def fake_gedit():
+    """Just enough of the gedit module for the plugin to load."""
+    gedit = types.ModuleType('gedit')
+    class Plugin(object):
+        def __init__(self):
+            pass
+        def get_data_dir(self):
+            return HERE
+    gedit.Plugin = Plugin
+    sys.modules['gedit'] = gedit
+
+class BottomPanel(object):
+    def __init__(self, toplevel):
+        self.toplevel = toplevel
+
+    def add_item(self, item, name, image):
+        self.toplevel.add(item)
+        item.show()
+
+    def remove_item(self, item):
+        self.toplevel.remove(item)
+
+class Window(object):
+    def __init__(self, gtk):
+        self.toplevel = gtk.Window()
+        self.toplevel.set_default_size(640, 480)
+        self.toplevel.show()
+        self.bottom = BottomPanel(self.toplevel)
+        self.data = {}
+
+    def get_bottom_panel(self):
+        return self.bottom
+
+    def get_active_document(self):
+        return None
+
+    def set_data(self, key, value):
+        self.data[key] = value
+
+    def get_data(self, key):
+        return self.data.get(key)
+
+class Cycler(object):
+    def __init__(self, command, timeout):
+        import gobject
+        import gtk
+        fake_gedit()
+        from session import Session
+        plugin = imp.load_source('smlconsole_plugin', os.path.join(PLUGIN, '__init__.py'))
+
+        self.gobject = gobject
+        self.gtk = gtk
+        self.timeout = timeout
+        Session.command = staticmethod(lambda config = None: (command, 'pipe'))
+        self.plugin = plugin.SMLConsolePlugin()
+        self.window = Window(gtk)
+
+    def pump(self, condition = None):
+        gtk = self.gtk
+        ticker = self.gobject.timeout_add(5, lambda: True)
+        deadline = time.time() + self.timeout
+        try:
+            while condition is not None and not condition():
+                if time.time() > deadline:
+                    raise RuntimeError('timed out waiting for the interpreter')
+                gtk.main_iteration(True)
+            while gtk.events_pending():
+                gtk.main_iteration(False)
+        finally:
+            self.gobject.source_remove(ticker)
+
+    def cycle(self):
+        self.plugin.activate(self.window)
+        panel = self.window.get_data('SMLConsolePluginInfo')
+        # Mapping the panel creates the console.
+        self.pump(lambda: panel.console is not None and panel.console.session.requests.ready)
+        self.plugin.deactivate(self.window)
+        self.pump()
+
+    def idle_wakeups(self, seconds):
+        from resources import Resources
+        before = Resources.wakeups
+        end = time.time() + seconds
+        while time.time() < end:
+            self.gtk.main_iteration(False) or time.sleep(0.01)
+        return Resources.wakeups - before
+
+    def measure(self, idle):
+        from config import SMLConsoleConfig
+        from resources import Resources
+        from console import SMLConsole
+        from session import Session
+
+        gc.collect()
+        objects = [o for o in gc.get_objects() if isinstance(o, (SMLConsole, Session))]
+        return {
+            'sources': Resources.live,
+            'handlers': len(SMLConsoleConfig.store().handlers),
+            'objects': len(objects),
+            'fds': len(os.listdir('/proc/self/fd')),
+            'wakeups': self.idle_wakeups(idle),
+            'memory': resident_mb(),
+        }
+
+def resident_mb():
+    f = open('/proc/self/statm')
+    try:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024)
+    finally:
+        f.close()
+
+def run(options, command):
+    cycler = Cycler(command, options.timeout)
+    start = time.time()
+    for i in range(options.warmup):
+        cycler.cycle()
+    before = cycler.measure(options.idle)
+    for i in range(options.cycles):
+        cycler.cycle()
+        if options.verbose and (i + 1) % 100 == 0:
+            print('%d cycles, %.1f MB' % (i + 1, resident_mb()))
+    after = cycler.measure(options.idle)
+    elapsed = time.time() - start
+
+    failed = False
+    for name in ('sources', 'handlers', 'objects', 'fds', 'wakeups', 'memory'):
+        limit = name == 'memory' and options.max_growth or 0
+        ok = after[name] - before[name] <= limit
+        failed = failed or not ok
+        print('%-9s %10.1f %10.1f  %s' % (name, before[name], after[name], ok and 'ok' or 'LEAK'))
+    print('%d cycles in %.1f s' % (options.warmup + options.cycles, elapsed))
+    return not failed
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--display', help = 'use this X display instead of starting Xvfb')
+    parser.add_option('--cycles', type = 'int', default = 2000)
+    parser.add_option('--warmup', type = 'int', default = 20)
+    parser.add_option('--idle', type = 'float', default = 2.0,
+                      help = 'seconds to count wakeups over')
+    parser.add_option('--max-growth', type = 'float', default = 8.0,
+                      help = 'MB the resident size may grow by')
+    parser.add_option('--timeout', type = 'float', default = 30.0)
+    parser.add_option('--verbose', action = 'store_true')
+    options, args = parser.parse_args()
+
+    command = [sys.executable, os.path.join(HERE, 'fakesml.py')]
+    home = tempfile.mkdtemp(prefix = 'smlconsole-leak-')
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(home, 'config')
+    os.environ['XDG_DATA_HOME'] = os.path.join(home, 'data')
+
+    xvfb = None
+    if options.display:
+        os.environ['DISPLAY'] = options.display
+    else:
+        xvfb, os.environ['DISPLAY'] = start_xvfb()
+    try:
+        ok = run(options, command)
+    finally:
+        if xvfb is not None:
+            xvfb.kill()
+            xvfb.wait()
+        shutil.rmtree(home, ignore_errors = True)
+    sys.exit(not ok and 1 or 0)
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# reader_throughput.py -- Micro-benchmark for the interpreter pipe reader
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Measures how many MB/s PipeReader moves from a process flooding its
+stdout, optionally next to the old byte-at-a-time loop.
+
+    python benchmarks/reader_throughput.py [--megabytes N] [--baseline]
+"""
+
+import fcntl
+import optparse
+import os
+import select
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'smlconsole'))
+from reader import PipeReader
+
+# Mixes ASCII with multibyte characters, so that some of them straddle
+# chunk boundaries.
+FLOOD = r'''
+import sys
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+line = u'> val x = [1, 2, 3] : int list (* æøå λ → *)\n'.encode('utf-8')
+block = line * (65536 // len(line))
+remaining = int(sys.argv[1])
+while remaining > 0:
+    out.write(block[:remaining])
+    remaining -= len(block)
+out.flush()
+'''
+
+def spawn(size):
+    proc = subprocess.Popen([sys.executable, '-c', FLOOD, str(size)],
+                            stdout = subprocess.PIPE)
+    fd = proc.stdout.fileno()
+    fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+    return proc, fd
+
+def run_reader(size):
+    proc, fd = spawn(size)
+    received = [0]
+    def consume(text):
+        received[0] += len(text)
+
+    reader = PipeReader(fd, consume)
+    start = time.time()
+    while not reader.eof:
+        select.select([fd], [], [])
+        reader.read()
+    elapsed = time.time() - start
+    proc.wait()
+    return elapsed, reader.bytes_read, reader.reads
+
+def run_baseline(size):
+    # The loop the console used to run: one read(1) per byte.
+    proc, fd = spawn(size)
+    pipe = proc.stdout
+    total = 0
+    reads = 0
+    start = time.time()
+    eof = False
+    while not eof:
+        select.select([fd], [], [])
+        data = b''
+        while True:
+            try:
+                c = pipe.read(1)
+            except IOError:
+                break
+            reads += 1
+            if not c:
+                eof = True
+                break
+            data += c
+        total += len(data)
+    elapsed = time.time() - start
+    proc.wait()
+    return elapsed, total, reads
+
+def report(name, elapsed, total, reads):
+    print('%-10s %8.1f MB/s  %10d bytes  %8d reads  %7.3f s' % (
+        name, total / elapsed / 1e6, total, reads, elapsed))
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--megabytes', type = 'float', default = 64.0)
+    parser.add_option('--baseline', action = 'store_true',
+                      help = 'also run the byte-at-a-time loop on 1/1024 of the data')
+    options, args = parser.parse_args()
+
+    size = int(options.megabytes * 1e6)
+    report('reader', *run_reader(size))
+    if options.baseline:
+        report('baseline', *run_baseline(size // 1024))
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
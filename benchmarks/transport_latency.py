@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# transport_latency.py -- Prompt round-trip latency per transport
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Compares the time from sending a phrase to seeing the next prompt
+over the pipe and pty transports, against fakesml.py or a real
+interpreter.
+
+    python benchmarks/transport_latency.py [--rounds N] [--buffering block]
+    python benchmarks/transport_latency.py --interpreter mosml -- -P full
+"""
+
+import optparse
+import os
+import select
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'smlconsole'))
+from reader import PipeReader
+from writer import PipeWriter
+from transport import InterpreterProcess, TRANSPORTS
+
+class Session(object):
+    def __init__(self, command, transport):
+        self.sml = InterpreterProcess(command, transport)
+        self.text = []
+        self.reader = PipeReader(self.sml.output_fd, self.text.append)
+        self.writer = PipeWriter(self.sml.input_fd)
+
+    def wait_for_prompt(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            tail = u''.join(self.text)[-3:]
+            if tail.endswith(u'\n- '):
+                del self.text[:]
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0 or self.reader.eof:
+                return False
+            wfds = [self.sml.input_fd] if self.writer.pending_bytes else []
+            r, w, x = select.select([self.sml.output_fd], wfds, [], remaining)
+            if w:
+                self.writer.flush()
+            if r:
+                self.reader.read()
+
+    def roundtrip(self, phrase, timeout):
+        start = time.time()
+        self.writer.write(phrase)
+        self.writer.flush()
+        if not self.wait_for_prompt(timeout):
+            return None
+        return time.time() - start
+
+    def close(self):
+        self.sml.kill()
+        self.sml.proc.wait()
+        self.sml.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rounds', type = 'int', default = 200)
+    parser.add_option('--timeout', type = 'float', default = 5.0)
+    parser.add_option('--buffering', choices = ['flush', 'block'], default = 'block',
+                      help = 'output buffering of the stand-in interpreter')
+    parser.add_option('--interpreter', help = 'run a real interpreter instead')
+    options, args = parser.parse_args()
+
+    if options.interpreter:
+        command = [options.interpreter] + args
+    else:
+        command = [sys.executable, os.path.join(HERE, 'fakesml.py'),
+                   '--buffering', options.buffering]
+
+    for transport in TRANSPORTS:
+        session = Session(command, transport)
+        try:
+            if not session.wait_for_prompt(options.timeout):
+                print('%-5s no prompt within %.1f s' % (transport, options.timeout))
+                continue
+            times = []
+            for i in range(options.rounds):
+                t = session.roundtrip(u'%d + 1;\n' % i, options.timeout)
+                if t is None:
+                    break
+                times.append(t * 1000)
+            if not times:
+                print('%-5s no response within %.1f s' % (transport, options.timeout))
+                continue
+            print('%-5s %4d rounds  median %8.2f ms  p95 %8.2f ms  max %8.2f ms' % (
+                transport, len(times), percentile(times, 0.5),
+                percentile(times, 0.95), max(times)))
+        finally:
+            session.close()
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
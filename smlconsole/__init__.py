@@ -23,9 +23,7 @@
 import gtk
 import gedit
 
-from console import SMLConsole
-from config import SMLConsoleConfigDialog
-from config import SMLConsoleConfig
+from panel import SMLConsolePanel
 
 SML_ICON = 'gnome-mime-text-x-python'
 
@@ -33,31 +31,46 @@ class SMLConsolePlugin(gedit.Plugin):
     def __init__(self):
         gedit.Plugin.__init__(self)
         self.dlg = None
+        self.sessions = None
 
     def activate(self, window):
+        # Nothing is imported or started for the console until the panel
+        # is first shown; see create_console.
+        panel = SMLConsolePanel(lambda: self.create_console(window))
+        bottom = window.get_bottom_panel()
+        image = gtk.Image()
+        image.set_from_icon_name(SML_ICON, gtk.ICON_SIZE_MENU)
+        bottom.add_item(panel, 'SML Console', image)
+        window.set_data('SMLConsolePluginInfo', panel)
+
+    def create_console(self, window):
+        from console import SMLConsole
+        from session import SessionManager
+
+        if self.sessions is None:
+            self.sessions = SessionManager(self.get_data_dir())
         console = SMLConsole(namespace = {'__builtins__' : __builtins__,
                                              'gedit' : gedit,
                                              'window' : window,
-                                             'datadir' : self.get_data_dir(), })
+                                             'datadir' : self.get_data_dir(), },
+                             sessions = self.sessions)
         #console.eval('print "You can access the main window through ' \
         #             '\'window\' :\\n%s" % window', False)
-        bottom = window.get_bottom_panel()
-        image = gtk.Image()
-        image.set_from_icon_name(SML_ICON, gtk.ICON_SIZE_MENU)
-        bottom.add_item(console, 'SML Console', image)
-        window.set_data('SMLConsolePluginInfo', console)
+        return console
 
     def deactivate(self, window):
-        console = window.get_data("SMLConsolePluginInfo")
-        console.stop()
+        panel = window.get_data("SMLConsolePluginInfo")
+        panel.stop()
         window.set_data("SMLConsolePluginInfo", None)
         bottom = window.get_bottom_panel()
-        bottom.remove_item(console)
+        bottom.remove_item(panel)
 
     def is_configurable(self):
         return True
 
     def create_configure_dialog(self):
+        from config import SMLConsoleConfigDialog
+
         if not self.dlg:
             self.dlg = SMLConsoleConfigDialog(self.get_data_dir())
 
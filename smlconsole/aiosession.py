@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# aiosession.py -- The session engine on an asyncio event loop
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Runs interpreter sessions from asyncio, without GTK:
+
+    async def main():
+        session = AsyncSession((['mosml', '-P', 'full'], 'pipe'))
+        await session.ready()
+        request = await session.submit('1 + 1;\\n')
+        async for event in session.events():
+            ...
+
+Any number of sessions can share one event loop. This module needs
+Python 3; the plugin itself runs the same engine on GLib."""
+
+import asyncio
+import os
+
+from engine import SessionEngine
+
+__all__ = ('AsyncioLoop', 'AsyncSession', 'Event')
+
+CHILD_POLL_INTERVAL = 0.1   # s between checks for exits without pidfd_open
+
+class AsyncioLoop(object):
+    """The event loop interface of loop.GObjectLoop, on asyncio."""
+
+    def __init__(self, loop = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.sources = {}       # Source -> function removing it
+        self.next_source = 1
+
+    def add(self, remove):
+        source = self.next_source
+        self.next_source += 1
+        self.sources[source] = remove
+        return source
+
+    def add_reader(self, fd, callback):
+        return self.add_fd(fd, callback, self.loop.add_reader, self.loop.remove_reader)
+
+    def add_writer(self, fd, callback):
+        return self.add_fd(fd, callback, self.loop.add_writer, self.loop.remove_writer)
+
+    def add_fd(self, fd, callback, add, remove):
+        def ready():
+            if not callback():
+                self.remove(source)
+        add(fd, ready)
+        source = self.add(lambda: remove(fd))
+        return source
+
+    def call_later(self, delay, callback, *args):
+        def fire():
+            if source not in self.sources:
+                return
+            if callback(*args):
+                handles[0] = self.loop.call_later(delay, fire)
+            else:
+                self.sources.pop(source, None)
+        handles = [self.loop.call_later(delay, fire)]
+        source = self.add(lambda: handles[0].cancel())
+        return source
+
+    def add_idle(self, callback, *args):
+        def fire():
+            if source not in self.sources:
+                return
+            if callback(*args):
+                handles[0] = self.loop.call_soon(fire)
+            else:
+                self.sources.pop(source, None)
+        handles = [self.loop.call_soon(fire)]
+        source = self.add(lambda: handles[0].cancel())
+        return source
+
+    def watch_child(self, pid, callback):
+        def reap():
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                reaped, status = pid, 0
+            if not reaped:
+                return True
+            self.remove(source)
+            callback(pid, status)
+            return False
+
+        try:
+            # A pidfd becomes readable when the process exits.
+            fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            fd = None
+        if fd is not None:
+            self.loop.add_reader(fd, reap)
+            def remove():
+                self.loop.remove_reader(fd)
+                os.close(fd)
+            source = self.add(remove)
+        else:
+            timer = self.call_later(CHILD_POLL_INTERVAL, reap)
+            source = self.add(lambda: self.remove(timer))
+        return source
+
+    def remove(self, source):
+        remove = self.sources.pop(source, None)
+        if remove is not None:
+            remove()
+
+class Event(object):
+    """Something a session announced: kind is 'output', 'notice' or
+    'status-changed', and text the output or notice."""
+
+    def __init__(self, kind, text = None):
+        self.kind = kind
+        self.text = text
+
+    def __repr__(self):
+        return 'Event(%r, %r)' % (self.kind, self.text)
+
+class AsyncSession(object):
+    """A SessionEngine with coroutines for waiting on it.
+
+    submit() returns the Request once the interpreter has finished it,
+    or once it is aborted by a restart. events() yields every Event from
+    the moment it is called; each caller gets all of them."""
+
+    def __init__(self, command, loop = None, pool = None, metrics = False):
+        self.loop = loop or asyncio.get_event_loop()
+        self.engine = SessionEngine(command, AsyncioLoop(self.loop), pool)
+        self.engine.enable_metrics(metrics)
+        self.waiting = {}       # Request -> future
+        self.queues = []
+        self.engine.connect('output', self.__event, 'output')
+        self.engine.connect('notice', self.__event, 'notice')
+        self.engine.connect('status-changed', self.__status_changed)
+        self.engine.connect('request-done', self.__request_done)
+        self.engine.start()
+
+    def __event(self, engine, text, kind):
+        self.publish(Event(kind, text))
+
+    def __status_changed(self, engine):
+        for (request, future) in list(self.waiting.items()):
+            if request.aborted:
+                self.resolve(request)
+        self.publish(Event('status-changed'))
+
+    def __request_done(self, engine, request):
+        self.resolve(request)
+
+    def resolve(self, request):
+        future = self.waiting.pop(request, None)
+        if future is not None and not future.done():
+            future.set_result(request)
+
+    def publish(self, event):
+        for queue in self.queues:
+            queue.put_nowait(event)
+
+    async def ready(self):
+        """Waits for the interpreter's first prompt. Returns False if
+        the supervisor gave up on starting it instead."""
+        events = self.events()
+        try:
+            async for event in events:
+                if self.engine.requests.ready or self.engine.gave_up:
+                    return self.engine.requests.ready
+        finally:
+            await events.aclose()
+
+    async def submit(self, command):
+        future = self.loop.create_future()
+        request = self.engine.submit(command)
+        self.waiting[request] = future
+        if request.finished is not None or request.aborted:
+            self.resolve(request)
+        return await future
+
+    async def events(self):
+        queue = asyncio.Queue()
+        self.queues.append(queue)
+        try:
+            # Yield at once if the state asked about already holds.
+            yield Event('status-changed')
+            while True:
+                yield await queue.get()
+        finally:
+            self.queues.remove(queue)
+
+    def restart(self):
+        self.engine.restart()
+
+    def interrupt(self):
+        self.engine.interrupt()
+
+    def statistics(self):
+        return self.engine.statistics()
+
+    def close(self):
+        self.engine.stop()
+        for request in list(self.waiting):
+            future = self.waiting.pop(request)
+            if not future.done():
+                future.cancel()
+
+# ex:et:ts=4:
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+# batch.py -- Evaluating many files at once
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import subprocess
+import tempfile
+import time
+
+from classify import OutputClassifier, ERROR
+from supervisor import exit_cause
+from loop import GObjectLoop
+from resources import kill_process
+
+__all__ = ('BatchRun', 'FileResult', 'find_sources', 'cpu_count',
+           'PASS', 'FAIL', 'ERROR_RESULT')
+
+PASS = 'pass'
+FAIL = 'fail'
+ERROR_RESULT = 'error'
+
+CHECK_INTERVAL = 100        # ms between checks of time and memory
+SOURCE_EXTENSIONS = ('.sml', '.sig')
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def find_sources(path):
+    """Returns the SML files under path, or path itself if it is one."""
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for (directory, subdirectories, files) in os.walk(path):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.endswith(SOURCE_EXTENSIONS):
+                found.append(os.path.join(directory, name))
+    return found
+
+def resident_size(pid):
+    """Returns the resident size of a process in bytes, or None where
+    /proc does not tell."""
+    try:
+        f = open('/proc/%d/statm' % pid)
+        try:
+            return int(f.read().split()[1]) * PAGE_SIZE
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, IndexError), e:
+        return None
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError), e:
+    PAGE_SIZE = 4096
+
+class FileResult(object):
+    def __init__(self, path, status, elapsed, detail = None):
+        self.path = path
+        self.status = status    # PASS, FAIL or ERROR_RESULT
+        self.elapsed = elapsed
+        self.detail = detail    # What went wrong, on one line
+
+class Job(object):
+    def __init__(self, path, proc, output):
+        self.path = path
+        self.proc = proc
+        self.output = output
+        self.started = time.time()
+        self.killed = None      # Why it was killed, if it was
+        self.watch = None
+
+class BatchRun(object):
+    """Evaluates SML files, each in an interpreter of its own, with up
+    to workers of them running at once.
+
+    A file is given to the interpreter on its standard input, from the
+    directory it is in. It passes if the interpreter reports no errors
+    and exits normally at the end of the file. It fails on an error, an
+    uncaught exception or any other exit status, and is an error if it
+    could not be run, took longer than timeout seconds or grew beyond
+    memory bytes, after which the interpreter is killed. The memory
+    limit is only checked where /proc tells how large a process is.
+
+    Larger files are started first, so that the last ones to finish are
+    short. result is called with each FileResult as it comes in, and
+    done with the list of them all. The timers and child watches are
+    registered on loop, a GObjectLoop unless given."""
+
+    def __init__(self, files, command, workers = None, timeout = None, memory = None,
+                 result = None, done = None, loop = None):
+        self.queue = sorted(files, key = file_size, reverse = True)
+        self.files = len(self.queue)
+        self.command = command
+        self.workers = max(1, workers or cpu_count())
+        self.timeout = timeout or None
+        self.memory = memory or None
+        self.result_cb = result
+        self.done_cb = done
+        self.loop = loop or GObjectLoop()
+        self.running = []
+        self.results = []
+        self.started = None
+        self.elapsed = None
+        self.check_source = None
+        self.cancelled = False
+
+    finished = property(lambda self: self.elapsed is not None)
+
+    def start(self):
+        self.started = time.time()
+        self.check_source = self.loop.call_later(CHECK_INTERVAL / 1000.0, self.__check_cb)
+        self.fill()
+
+    def fill(self):
+        while self.queue and len(self.running) < self.workers and not self.cancelled:
+            self.spawn(self.queue.pop(0))
+        if not self.running:
+            self.finish()
+
+    def spawn(self, path):
+        started = time.time()
+        output = tempfile.TemporaryFile()
+        try:
+            source = open(path, 'rb')
+            try:
+                proc = subprocess.Popen(self.command, stdin = source, stdout = output,
+                                        stderr = subprocess.STDOUT,
+                                        cwd = os.path.dirname(os.path.abspath(path)),
+                                        close_fds = os.name != 'nt')
+            finally:
+                source.close()
+        except (IOError, OSError), e:
+            output.close()
+            self.record(FileResult(path, ERROR_RESULT, time.time() - started, e.strerror))
+            return
+
+        job = Job(path, proc, output)
+        if os.name != 'nt':
+            job.watch = self.loop.watch_child(proc.pid,
+                                              lambda pid, status: self.__exit_cb(pid, status, job))
+        self.running.append(job)
+
+    def __exit_cb(self, pid, status, job):
+        job.watch = None
+        # Popen has to learn of the exit too, or it will try to reap it.
+        job.proc.returncode = os.WIFSIGNALED(status) and -os.WTERMSIG(status) or \
+                              os.WEXITSTATUS(status)
+        self.exited(job, status)
+
+    def __check_cb(self):
+        now = time.time()
+        for job in self.running[:]:
+            if job.watch is None and job.proc.poll() is not None:
+                # Windows, where there are no child watches.
+                self.exited(job, job.proc.returncode)
+                continue
+            if job.killed is not None:
+                continue
+            if self.timeout and now - job.started > self.timeout:
+                self.kill(job, 'timed out after %s s' % self.timeout)
+            elif self.memory:
+                size = resident_size(job.proc.pid)
+                if size is not None and size > self.memory:
+                    self.kill(job, 'used more than %d MB' % (self.memory // (1024 * 1024)))
+        return True
+
+    def kill(self, job, reason):
+        job.killed = reason
+        try:
+            job.proc.kill()
+        except OSError, e:
+            pass
+
+    def exited(self, job, status):
+        self.running.remove(job)
+        elapsed = time.time() - job.started
+        if job.killed is not None:
+            result = FileResult(job.path, ERROR_RESULT, elapsed, job.killed)
+        else:
+            job.output.seek(0)
+            error = first_error(job.output.read().decode('utf-8', 'replace'))
+            if error is not None:
+                result = FileResult(job.path, FAIL, elapsed, error)
+            elif status:
+                result = FileResult(job.path, FAIL, elapsed, 'exited with ' + exit_cause(status))
+            else:
+                result = FileResult(job.path, PASS, elapsed)
+        job.output.close()
+        self.record(result)
+        self.fill()
+
+    def record(self, result):
+        self.results.append(result)
+        if self.result_cb is not None:
+            self.result_cb(result)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.elapsed = time.time() - self.started
+        if self.check_source is not None:
+            self.loop.remove(self.check_source)
+            self.check_source = None
+        if self.done_cb is not None:
+            self.done_cb(self.results)
+
+    def cancel(self):
+        """Kills the running interpreters and starts no more."""
+        self.cancelled = True
+        self.queue = []
+        for job in self.running:
+            if job.killed is None:
+                self.kill(job, 'cancelled')
+        if not self.running and self.started is not None:
+            self.finish()
+
+    def stop(self):
+        """Kills the running interpreters and waits for them, without
+        reporting anything more."""
+        self.result_cb = self.done_cb = None
+        self.cancelled = True
+        self.queue = []
+        for job in self.running:
+            if job.watch is not None:
+                self.loop.remove(job.watch)
+                job.watch = None
+            kill_process(job.proc)
+            job.output.close()
+        self.running = []
+        if self.started is not None:
+            self.finish()
+
+    def counts(self):
+        counts = {PASS: 0, FAIL: 0, ERROR_RESULT: 0}
+        for result in self.results:
+            counts[result.status] += 1
+        return counts
+
+    def summary(self):
+        counts = self.counts()
+        text = '%d passed, %d failed, %d errors' % (counts[PASS], counts[FAIL],
+                                                     counts[ERROR_RESULT])
+        if len(self.results) < self.files:
+            text += ', %d not run' % (self.files - len(self.results))
+        elapsed = self.elapsed
+        if elapsed is None:
+            elapsed = time.time() - self.started
+        busy = sum([result.elapsed for result in self.results])
+        return '%s in %.2f s (%.2f s of evaluation on %d workers)' % \
+               (text, elapsed, busy, self.workers)
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError, e:
+        return 0
+
+def first_error(output):
+    """Returns one line saying what the first error in output is, or
+    None. That is the line with "Error:" from SML/NJ, and the last line
+    of the block from Moscow ML, which starts with where it is."""
+    classifier = OutputClassifier()
+    for (text, kind) in classifier.feed(output) + classifier.release():
+        if kind != ERROR:
+            continue
+        lines = [line.strip(u'! \t') for line in text.splitlines()]
+        lines = [line for line in lines if line]
+        for line in lines:
+            if u'Error:' in line:
+                return line
+        if lines:
+            return lines[-1]
+    return None
+
+def format_result(result, root = None):
+    path = result.path
+    if root is not None and os.path.isdir(root):
+        path = os.path.relpath(path, root)
+    line = '%-5s %8.2f s  %s' % (result.status.upper(), result.elapsed, path)
+    if result.detail:
+        line += ': ' + result.detail
+    return line
+
+def main():
+    import optparse
+    import shlex
+    from config import SMLConsoleConfig
+
+    parser = optparse.OptionParser(usage = '%prog [options] FILE-OR-DIRECTORY...')
+    parser.add_option('--workers', type = 'int', help = 'interpreters running at once')
+    parser.add_option('--timeout', type = 'float', help = 'seconds allowed per file')
+    parser.add_option('--memory', type = 'int', help = 'MB allowed per interpreter')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('no files given')
+
+    config = SMLConsoleConfig()
+    command = [config.sml_interpreter] + shlex.split(config.sml_flags)
+    files = []
+    for path in args:
+        files.extend(find_sources(path))
+    root = len(args) == 1 and args[0] or None
+
+    import gobject
+
+    loop = gobject.MainLoop()
+    def result(result):
+        print(format_result(result, root).encode('utf-8'))
+    def done(results):
+        loop.quit()
+    memory = options.memory
+    if memory is None:
+        memory = config.batch_memory
+    run = BatchRun(files, command,
+                   workers = options.workers or config.batch_workers,
+                   timeout = options.timeout or config.batch_timeout,
+                   memory = memory * 1024 * 1024,
+                   result = result, done = done)
+    run.start()
+    if not run.finished:
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            run.cancel()
+    print(run.summary())
+    counts = run.counts()
+    raise SystemExit((counts[FAIL] or counts[ERROR_RESULT]) and 1 or 0)
+
+if __name__ == '__main__':
+    main()
+
+# ex:et:ts=4:
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# classify.py -- Finding errors and warnings in interpreter output
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import re
+
+from symbols import BINDING
+
+__all__ = ('OutputClassifier', 'BindingFilter', 'NORMAL', 'ERROR', 'WARNING')
+
+NORMAL = 'normal'
+ERROR = 'error'
+WARNING = 'warning'
+
+MOSML = 'mosml'
+SMLNJ = 'smlnj'
+
+PROMPTS = re.compile(u'(?:[-=] )*')
+# SML/NJ: "stdIn:1.6-1.9 Error: unbound variable or constructor: y"
+SMLNJ_DIAGNOSTIC = re.compile(u'[\\w./\\\\-]+:\\d+\\.\\d+(?:-\\d+\\.\\d+)? (Error|Warning)\\b')
+# What the start of such a line can look like before the rest arrives.
+SMLNJ_PREFIX = re.compile(u'[\\w./\\\\-]+(?::[\\d.-]*(?: \\w*)?)?$')
+PROMPT_RUN = re.compile(u'^(?:[-=] )+')
+UNCAUGHT = u'uncaught exception'
+# The start of any line that may need a closer look.
+SUSPECT = re.compile(u'(?m)^(?:[-=] )*(?:!|uncaught exception|[\\w./\\\\-]+:\\d+\\.\\d+)')
+
+class OutputClassifier(object):
+    """Splits interpreter output into normal text, errors and warnings.
+
+    Moscow ML prints diagnostics as a block of lines starting with "! ",
+    which is a warning if one of them starts "! Warning:". The first
+    line follows the prompt the interpreter printed before reading the
+    offending input. SML/NJ starts them with a "file:line.col Error:" or
+    "Warning:" line, followed by indented lines.
+
+    feed() returns the text it was given as a list of (text, kind),
+    with runs of the same kind merged. Outside a diagnostic, one regular
+    expression search skips to the next line that might start one. A
+    diagnostic block is held back until the line after it shows where it
+    ends, and so is the start of a line until it is clear whether it
+    begins a diagnostic; release() gives up waiting and returns what is
+    held."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.partial = u''      # Start of a line, held back
+        self.block = []         # Lines of the diagnostic being read
+        self.style = None       # MOSML or SMLNJ while reading one
+        self.kind = None
+        self.at_line_start = True
+
+    holding = property(lambda self: bool(self.partial or self.block))
+
+    def feed(self, text):
+        out = []
+        data = self.partial + text
+        self.partial = u''
+        pos = 0
+        if not self.at_line_start:
+            # The rest of a line whose start was released as normal text.
+            end = data.find(u'\n') + 1
+            if not end:
+                self.emit(out, data, NORMAL)
+                return joined(out)
+            self.emit(out, data[:end], NORMAL)
+            pos = end
+            self.at_line_start = True
+
+        while True:
+            if self.style is None:
+                # Lines that cannot start a diagnostic go out in one piece.
+                m = SUSPECT.search(data, pos)
+                if m is None:
+                    end = data.rfind(u'\n', pos) + 1
+                    self.emit(out, data[pos:end], NORMAL)
+                    pos = max(pos, end)
+                    break
+                self.emit(out, data[pos:m.start()], NORMAL)
+                pos = m.start()
+            end = data.find(u'\n', pos) + 1
+            if not end:
+                break
+            self.line(out, data[pos:end])
+            pos = end
+
+        if pos < len(data):
+            self.start_of_line(out, data[pos:])
+        return joined(out)
+
+    def release(self):
+        out = []
+        self.end_block(out)
+        if self.partial:
+            self.emit(out, self.partial, NORMAL)
+            self.partial = u''
+            self.at_line_start = False
+        return joined(out)
+
+    def line(self, out, line):
+        if self.style == MOSML and line.startswith(u'!'):
+            self.add_to_block(line)
+            return
+        if self.style == SMLNJ and line[:1] in (u' ', u'\t'):
+            self.add_to_block(line)
+            return
+        self.end_block(out)
+
+        prompts = PROMPTS.match(line).end()
+        if prompts:
+            self.emit(out, line[:prompts], NORMAL)
+            line = line[prompts:]
+
+        if line.startswith(u'!'):
+            self.start_block(MOSML, ERROR, line)
+            return
+        m = SMLNJ_DIAGNOSTIC.match(line)
+        if m is not None:
+            self.start_block(SMLNJ, m.group(1) == u'Error' and ERROR or WARNING, line)
+        elif line.startswith(UNCAUGHT):
+            self.emit(out, line, ERROR)
+        else:
+            self.emit(out, line, NORMAL)
+
+    def start_of_line(self, out, text):
+        """Deals with text after the last newline."""
+        if self.style == MOSML and text.startswith(u'!') or \
+           self.style == SMLNJ and text[:1] in (u' ', u'\t'):
+            self.partial = text
+            return
+        self.end_block(out)
+
+        prompts = PROMPTS.match(text).end()
+        if prompts:
+            self.emit(out, text[:prompts], NORMAL)
+            text = text[prompts:]
+        if not text:
+            return
+
+        if text.startswith(u'!') or SMLNJ_PREFIX.match(text) or SMLNJ_DIAGNOSTIC.match(text) or \
+           UNCAUGHT.startswith(text) or text.startswith(UNCAUGHT):
+            self.partial = text
+        else:
+            self.emit(out, text, NORMAL)
+            self.at_line_start = False
+
+    def start_block(self, style, kind, line):
+        self.style = style
+        self.kind = kind
+        self.block = []
+        self.add_to_block(line)
+
+    def add_to_block(self, line):
+        if self.style == MOSML and line.startswith(u'! Warning:'):
+            self.kind = WARNING
+        self.block.append(line)
+
+    def end_block(self, out):
+        if self.block:
+            self.emit(out, u''.join(self.block), self.kind)
+        self.block = []
+        self.style = None
+        self.kind = None
+
+    @staticmethod
+    def emit(out, text, kind):
+        if not text:
+            return
+        if out and out[-1][1] == kind:
+            out[-1][0].append(text)
+        else:
+            out.append(([text], kind))
+
+class BindingFilter(object):
+    """Drops what the interpreter says about each declaration, for
+    loading a document quietly: the lines of normal output matching
+    symbols.BINDING, the members of a structure SML/NJ lists after them,
+    and all but the last prompt of a run. Anything else goes through.
+
+    feed() takes what OutputClassifier returns, and returns what is left
+    of it. The start of a line is held back until the rest of it comes,
+    or release() is called."""
+
+    def __init__(self):
+        self.partial = u''
+        self.in_signature = False
+        self.errors = False     # Whether there was an error
+        self.dropped = 0        # Lines dropped
+
+    def feed(self, text, kind):
+        if kind != NORMAL:
+            self.errors = self.errors or kind == ERROR
+            return text
+
+        data = self.partial + text
+        end = data.rfind(u'\n') + 1
+        self.partial = data[end:]
+        kept = []
+        for line in data[:end].splitlines(True):
+            if self.in_signature:
+                self.in_signature = line.strip() != u'end'
+            elif BINDING.match(line):
+                self.in_signature = line.rstrip().endswith((u'sig', u':'))
+            else:
+                kept.append(last_prompt(line))
+                continue
+            self.dropped += 1
+        return u''.join(kept)
+
+    def release(self):
+        text = last_prompt(self.partial)
+        self.partial = u''
+        return text
+
+def last_prompt(text):
+    return PROMPT_RUN.sub(lambda m: m.group()[-2:], text)
+
+def joined(out):
+    return [(u''.join(texts), kind) for (texts, kind) in out]
+
+# ex:et:ts=4:
@@ -20,6 +20,7 @@
 
 # Based on pythonconsole included with gedit.
 
+import json
 import os
 import gtk
 
@@ -28,11 +29,26 @@ __all__ = ('SMLConsoleConfig', 'SMLConsoleConfigDialog')
 GCONF_KEY_BASE = '/apps/gedit-2/plugins/smlconsole'
 GCONF_KEY_COMMAND_COLOR = GCONF_KEY_BASE + '/command-color'
 GCONF_KEY_ERROR_COLOR = GCONF_KEY_BASE + '/error-color'
+GCONF_KEY_WARNING_COLOR = GCONF_KEY_BASE + '/warning-color'
 GCONF_KEY_SML_INTERPRETER = GCONF_KEY_BASE + '/sml-interpreter'
 GCONF_KEY_SML_FLAGS = GCONF_KEY_BASE + '/sml-flags'
+GCONF_KEY_SCROLLBACK_LINES = GCONF_KEY_BASE + '/scrollback-lines'
+GCONF_KEY_SML_TRANSPORT = GCONF_KEY_BASE + '/sml-transport'
+GCONF_KEY_INCREMENTAL_RELOAD = GCONF_KEY_BASE + '/incremental-reload'
+GCONF_KEY_UNIT_CACHE = GCONF_KEY_BASE + '/unit-cache'
+GCONF_KEY_METRICS = GCONF_KEY_BASE + '/metrics'
+GCONF_KEY_SML_SESSIONS = GCONF_KEY_BASE + '/sml-sessions'
+GCONF_KEY_IDLE_TIMEOUT = GCONF_KEY_BASE + '/idle-timeout'
+GCONF_KEY_HISTORY_SIZE = GCONF_KEY_BASE + '/history-size'
+GCONF_KEY_BATCH_WORKERS = GCONF_KEY_BASE + '/batch-workers'
+GCONF_KEY_BATCH_TIMEOUT = GCONF_KEY_BASE + '/batch-timeout'
+GCONF_KEY_BATCH_MEMORY = GCONF_KEY_BASE + '/batch-memory'
+GCONF_KEY_OUTPUT_RATE = GCONF_KEY_BASE + '/output-rate'
+GCONF_KEY_QUIET_RELOAD = GCONF_KEY_BASE + '/quiet-reload'
 
 DEFAULT_COMMAND_COLOR = '#314e6c' # Blue Shadow
 DEFAULT_ERROR_COLOR = '#990000' # Accent Red Dark
+DEFAULT_WARNING_COLOR = '#c4a000' # Butter Dark
 DEFAULT_SML_INTERPRETERS = [
     r'C:\Program Files\Moscow ML\bin\mosml.exe',
     r'C:\Program Files\MosMLogEmacs\mosml\bin\mosml.exe',
@@ -40,6 +56,140 @@ DEFAULT_SML_INTERPRETERS = [
     r'/usr/bin/sml',
 ]
 DEFAULT_SML_FLAGS = '-P full'
+DEFAULT_SCROLLBACK_LINES = 10000
+DEFAULT_SML_TRANSPORT = 'pipe'
+DEFAULT_INCREMENTAL_RELOAD = False
+DEFAULT_UNIT_CACHE = False
+DEFAULT_METRICS = False
+DEFAULT_SML_SESSIONS = 'separate'
+DEFAULT_IDLE_TIMEOUT = 0        # Minutes; 0 never stops an interpreter
+DEFAULT_HISTORY_SIZE = 100000   # Entries kept in the history file
+DEFAULT_BATCH_WORKERS = 0       # 0 runs one interpreter per processor
+DEFAULT_BATCH_TIMEOUT = 60      # Seconds per file
+DEFAULT_BATCH_MEMORY = 1024     # MB per interpreter; 0 for no limit
+DEFAULT_OUTPUT_RATE = 1024      # KB/s of output before it is paused; 0 for no limit
+DEFAULT_QUIET_RELOAD = True
+
+def config_file():
+    base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(base, 'gedit-smlconsole', 'config.json')
+
+class GConfStore(object):
+    """The preferences in gconf. Each value is read once and kept until
+    gconf reports that it has changed, before any handler is told."""
+
+    def __init__(self, gconf):
+        self.gconf = gconf
+        self.types = {str: gconf.VALUE_STRING, int: gconf.VALUE_INT, bool: gconf.VALUE_BOOL}
+        self.values = {}
+        self.handlers = []
+        self.client = gconf.client_get_default()
+        self.client.add_dir(GCONF_KEY_BASE, gconf.CLIENT_PRELOAD_NONE)
+        self.client.notify_add(GCONF_KEY_BASE, self.notified)
+
+    def get(self, key, kind):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        val = self.client.get(key)
+        value = None
+        if val is not None and val.type == self.types[kind]:
+            if kind is str:
+                value = val.get_string()
+            elif kind is int:
+                value = val.get_int()
+            else:
+                value = val.get_bool()
+        self.values[key] = value
+        return value
+
+    def set(self, key, kind, value):
+        v = self.gconf.Value(self.types[kind])
+        if kind is str:
+            v.set_string(value)
+        elif kind is int:
+            v.set_int(value)
+        else:
+            v.set_bool(value)
+        self.client.set(key, v)
+        self.values[key] = value
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    def notified(self, client, id, entry, data):
+        self.values.pop(entry.key, None)
+        for handler in list(self.handlers):
+            handler(client, id, entry, data)
+
+class FileStore(object):
+    """The preferences in a JSON file, for when gconf is not available.
+    Handlers are told about changes made in this process only."""
+
+    def __init__(self, path = None):
+        self.path = path or config_file()
+        self.values = {}
+        self.handlers = []
+        try:
+            f = open(self.path)
+            try:
+                values = json.load(f)
+            finally:
+                f.close()
+            if isinstance(values, dict):
+                self.values = values
+        except (IOError, ValueError), e:
+            pass
+
+    @staticmethod
+    def name(key):
+        return key[len(GCONF_KEY_BASE) + 1:]
+
+    def get(self, key, kind):
+        value = self.values.get(self.name(key))
+        if kind is str and isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, kind) and (kind is bool) == isinstance(value, bool):
+            return value
+        return None
+
+    def set(self, key, kind, value):
+        self.values[self.name(key)] = value
+        try:
+            self.save()
+        except (IOError, OSError), e:
+            pass
+        for handler in list(self.handlers):
+            handler(self, None, key, None)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Written next to the old file and renamed over it, so a crash
+        # never leaves half a file behind.
+        temp = self.path + '.tmp'
+        f = open(temp, 'w')
+        try:
+            json.dump(self.values, f, indent = 2, sort_keys = True)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp, self.path)
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
 
 class SMLConsoleConfig(object):
     try:
@@ -47,6 +197,9 @@ class SMLConsoleConfig(object):
     except ImportError:
         gconf = None
 
+    _store = None
+    _interpreter = None
+
     def __init__(self):
         pass
 
@@ -54,54 +207,132 @@ class SMLConsoleConfig(object):
     def enabled():
         return SMLConsoleConfig.gconf != None
 
+    @staticmethod
+    def store():
+        if SMLConsoleConfig._store is None:
+            if SMLConsoleConfig.gconf:
+                SMLConsoleConfig._store = GConfStore(SMLConsoleConfig.gconf)
+            else:
+                SMLConsoleConfig._store = FileStore()
+        return SMLConsoleConfig._store
+
     @staticmethod
     def add_handler(handler):
-        if SMLConsoleConfig.gconf:
-            SMLConsoleConfig.gconf.client_get_default().notify_add(GCONF_KEY_BASE, handler)
+        SMLConsoleConfig.store().add_handler(handler)
+
+    @staticmethod
+    def remove_handler(handler):
+        SMLConsoleConfig.store().remove_handler(handler)
 
     @staticmethod
     def find_an_interpreter():
-        valid_interpreters = filter(lambda f: os.path.exists(f), DEFAULT_SML_INTERPRETERS)
-        if valid_interpreters:
-            return valid_interpreters[0]
-        else:
-            return 'mosml'
+        # Looked for once; an interpreter installed later is found on
+        # the next start of gedit, or can be chosen in the preferences.
+        if SMLConsoleConfig._interpreter is None:
+            SMLConsoleConfig._interpreter = search_interpreter()
+        return SMLConsoleConfig._interpreter
 
     color_command = property(
-        lambda self: self.gconf_get_str(GCONF_KEY_COMMAND_COLOR, lambda: DEFAULT_COMMAND_COLOR),
-        lambda self, value: self.gconf_set_str(GCONF_KEY_COMMAND_COLOR, value))
+        lambda self: self.get(GCONF_KEY_COMMAND_COLOR, str, lambda: DEFAULT_COMMAND_COLOR),
+        lambda self, value: self.set(GCONF_KEY_COMMAND_COLOR, str, value))
 
     color_error = property(
-        lambda self: self.gconf_get_str(GCONF_KEY_ERROR_COLOR, lambda: DEFAULT_ERROR_COLOR),
-        lambda self, value: self.gconf_set_str(GCONF_KEY_ERROR_COLOR, value))
+        lambda self: self.get(GCONF_KEY_ERROR_COLOR, str, lambda: DEFAULT_ERROR_COLOR),
+        lambda self, value: self.set(GCONF_KEY_ERROR_COLOR, str, value))
+
+    color_warning = property(
+        lambda self: self.get(GCONF_KEY_WARNING_COLOR, str, lambda: DEFAULT_WARNING_COLOR),
+        lambda self, value: self.set(GCONF_KEY_WARNING_COLOR, str, value))
 
     sml_interpreter = property(
-        lambda self: self.gconf_get_str(GCONF_KEY_SML_INTERPRETER, self.find_an_interpreter),
-        lambda self, value: self.gconf_set_str(GCONF_KEY_SML_INTERPRETER, value))
+        lambda self: self.get(GCONF_KEY_SML_INTERPRETER, str, self.find_an_interpreter),
+        lambda self, value: self.set(GCONF_KEY_SML_INTERPRETER, str, value))
 
     sml_flags = property(
-        lambda self: self.gconf_get_str(GCONF_KEY_SML_FLAGS, lambda: DEFAULT_SML_FLAGS),
-        lambda self, value: self.gconf_set_str(GCONF_KEY_SML_FLAGS, value))
+        lambda self: self.get(GCONF_KEY_SML_FLAGS, str, lambda: DEFAULT_SML_FLAGS),
+        lambda self, value: self.set(GCONF_KEY_SML_FLAGS, str, value))
 
-    @staticmethod
-    def gconf_get_str(key, default=lambda: ''):
-        if not SMLConsoleConfig.gconf:
-            return default()
+    sml_transport = property(
+        lambda self: self.get(GCONF_KEY_SML_TRANSPORT, str, lambda: DEFAULT_SML_TRANSPORT),
+        lambda self, value: self.set(GCONF_KEY_SML_TRANSPORT, str, value))
 
-        val = SMLConsoleConfig.gconf.client_get_default().get(key)
-        if val is not None and val.type == gconf.VALUE_STRING:
-            return val.get_string()
-        else:
-            return default()
+    incremental_reload = property(
+        lambda self: self.get(GCONF_KEY_INCREMENTAL_RELOAD, bool, lambda: DEFAULT_INCREMENTAL_RELOAD),
+        lambda self, value: self.set(GCONF_KEY_INCREMENTAL_RELOAD, bool, value))
+
+    quiet_reload = property(
+        lambda self: self.get(GCONF_KEY_QUIET_RELOAD, bool, lambda: DEFAULT_QUIET_RELOAD),
+        lambda self, value: self.set(GCONF_KEY_QUIET_RELOAD, bool, value))
+
+    unit_cache = property(
+        lambda self: self.get(GCONF_KEY_UNIT_CACHE, bool, lambda: DEFAULT_UNIT_CACHE),
+        lambda self, value: self.set(GCONF_KEY_UNIT_CACHE, bool, value))
+
+    metrics = property(
+        lambda self: self.get(GCONF_KEY_METRICS, bool, lambda: DEFAULT_METRICS),
+        lambda self, value: self.set(GCONF_KEY_METRICS, bool, value))
+
+    sml_sessions = property(
+        lambda self: self.get(GCONF_KEY_SML_SESSIONS, str, lambda: DEFAULT_SML_SESSIONS),
+        lambda self, value: self.set(GCONF_KEY_SML_SESSIONS, str, value))
+
+    idle_timeout = property(
+        lambda self: self.get(GCONF_KEY_IDLE_TIMEOUT, int, lambda: DEFAULT_IDLE_TIMEOUT),
+        lambda self, value: self.set(GCONF_KEY_IDLE_TIMEOUT, int, value))
+
+    history_size = property(
+        lambda self: self.get(GCONF_KEY_HISTORY_SIZE, int, lambda: DEFAULT_HISTORY_SIZE),
+        lambda self, value: self.set(GCONF_KEY_HISTORY_SIZE, int, value))
+
+    batch_workers = property(
+        lambda self: self.get(GCONF_KEY_BATCH_WORKERS, int, lambda: DEFAULT_BATCH_WORKERS),
+        lambda self, value: self.set(GCONF_KEY_BATCH_WORKERS, int, value))
+
+    batch_timeout = property(
+        lambda self: self.get(GCONF_KEY_BATCH_TIMEOUT, int, lambda: DEFAULT_BATCH_TIMEOUT),
+        lambda self, value: self.set(GCONF_KEY_BATCH_TIMEOUT, int, value))
+
+    batch_memory = property(
+        lambda self: self.get(GCONF_KEY_BATCH_MEMORY, int, lambda: DEFAULT_BATCH_MEMORY),
+        lambda self, value: self.set(GCONF_KEY_BATCH_MEMORY, int, value))
+
+    output_rate = property(
+        lambda self: self.get(GCONF_KEY_OUTPUT_RATE, int, lambda: DEFAULT_OUTPUT_RATE),
+        lambda self, value: self.set(GCONF_KEY_OUTPUT_RATE, int, value))
+
+    scrollback_lines = property(
+        lambda self: self.get(GCONF_KEY_SCROLLBACK_LINES, int, lambda: DEFAULT_SCROLLBACK_LINES),
+        lambda self, value: self.set(GCONF_KEY_SCROLLBACK_LINES, int, value))
 
     @staticmethod
-    def gconf_set_str(key, value):
-        if not SMLConsoleConfig.gconf:
-            return
+    def get(key, kind, default):
+        value = SMLConsoleConfig.store().get(key, kind)
+        if value is None:
+            return default()
+        return value
 
-        v = SMLConsoleConfig.gconf.Value(gconf.VALUE_STRING)
-        v.set_string(value)
-        SMLConsoleConfig.gconf.client_get_default().set(key, v)
+    @staticmethod
+    def set(key, kind, value):
+        SMLConsoleConfig.store().set(key, kind, value)
+
+def search_interpreter():
+    """Returns the first of DEFAULT_SML_INTERPRETERS that exists, or else
+    the first of their names found on $PATH, or else 'mosml'."""
+    for path in DEFAULT_SML_INTERPRETERS:
+        if os.path.exists(path):
+            return path
+
+    names = []
+    for path in DEFAULT_SML_INTERPRETERS:
+        name = os.path.basename(path.replace('\\', '/'))
+        if name not in names:
+            names.append(name)
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        for name in names:
+            path = os.path.join(directory, name)
+            if directory and os.path.isfile(path):
+                return path
+    return 'mosml'
 
 class SMLConsoleConfigDialog(object):
 
@@ -120,11 +351,39 @@ class SMLConsoleConfigDialog(object):
                                         self.config.color_command)
             self.set_colorbutton_color(self._ui.get_object('colorbutton-error'),
                                         self.config.color_error)
+            self.set_colorbutton_color(self._ui.get_object('colorbutton-warning'),
+                                        self.config.color_warning)
 
             self._ui.get_object('interpreter-select').set_filename(self.config.sml_interpreter)
 
             self._ui.get_object('flags-input').set_text(self.config.sml_flags)
 
+            self._ui.get_object('use-pty').set_active(self.config.sml_transport == 'pty')
+
+            self._ui.get_object('incremental-reload').set_active(self.config.incremental_reload)
+
+            self._ui.get_object('unit-cache').set_active(self.config.unit_cache)
+
+            self._ui.get_object('metrics').set_active(self.config.metrics)
+
+            self._ui.get_object('share-sessions').set_active(self.config.sml_sessions == 'shared')
+
+            self._ui.get_object('idle-timeout').set_value(self.config.idle_timeout)
+
+            self._ui.get_object('scrollback-lines').set_value(self.config.scrollback_lines)
+
+            self._ui.get_object('history-size').set_value(self.config.history_size)
+
+            self._ui.get_object('batch-workers').set_value(self.config.batch_workers)
+
+            self._ui.get_object('batch-timeout').set_value(self.config.batch_timeout)
+
+            self._ui.get_object('batch-memory').set_value(self.config.batch_memory)
+
+            self._ui.get_object('output-rate').set_value(self.config.output_rate)
+
+            self._ui.get_object('quiet-reload').set_active(self.config.quiet_reload)
+
             self._ui.connect_signals(self)
 
             self._dialog = self._ui.get_object('dialog-config')
@@ -156,10 +415,52 @@ class SMLConsoleConfigDialog(object):
     def on_colorbutton_error_color_set(self, colorbutton):
         self.config.color_error = colorbutton.get_color().to_string()
 
+    def on_colorbutton_warning_color_set(self, colorbutton):
+        self.config.color_warning = colorbutton.get_color().to_string()
+
     def on_interpreter_select_file_set(self, filebutton):
         self.config.sml_interpreter = filebutton.get_filename()
 
     def on_flags_input_changed(self, input):
         self.config.sml_flags = input.get_text()
 
+    def on_use_pty_toggled(self, checkbutton):
+        self.config.sml_transport = checkbutton.get_active() and 'pty' or 'pipe'
+
+    def on_incremental_reload_toggled(self, checkbutton):
+        self.config.incremental_reload = checkbutton.get_active()
+
+    def on_unit_cache_toggled(self, checkbutton):
+        self.config.unit_cache = checkbutton.get_active()
+
+    def on_metrics_toggled(self, checkbutton):
+        self.config.metrics = checkbutton.get_active()
+
+    def on_share_sessions_toggled(self, checkbutton):
+        self.config.sml_sessions = checkbutton.get_active() and 'shared' or 'separate'
+
+    def on_idle_timeout_value_changed(self, spinbutton):
+        self.config.idle_timeout = spinbutton.get_value_as_int()
+
+    def on_scrollback_lines_value_changed(self, spinbutton):
+        self.config.scrollback_lines = spinbutton.get_value_as_int()
+
+    def on_history_size_value_changed(self, spinbutton):
+        self.config.history_size = spinbutton.get_value_as_int()
+
+    def on_batch_workers_value_changed(self, spinbutton):
+        self.config.batch_workers = spinbutton.get_value_as_int()
+
+    def on_batch_timeout_value_changed(self, spinbutton):
+        self.config.batch_timeout = spinbutton.get_value_as_int()
+
+    def on_batch_memory_value_changed(self, spinbutton):
+        self.config.batch_memory = spinbutton.get_value_as_int()
+
+    def on_output_rate_value_changed(self, spinbutton):
+        self.config.output_rate = spinbutton.get_value_as_int()
+
+    def on_quiet_reload_toggled(self, checkbutton):
+        self.config.quiet_reload = checkbutton.get_active()
+
 # ex:et:ts=4:
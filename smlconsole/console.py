@@ -27,26 +27,61 @@ import traceback
 import gobject
 import gtk
 import pango
-import subprocess
 import os
-import shlex
+import time
+import urllib
 
 from config import SMLConsoleConfig
+from output import OutputQueue
+from transcript import Transcript
+from history import shared_history
+from session import Session
+from loop import GObjectLoop
+from resources import Resources
+from decls import split_declarations
+from unitcache import UnitCache, find_compiler, load_expression, used_file
+from classify import OutputClassifier, BindingFilter, NORMAL, ERROR, WARNING
+from symbols import common_prefix
+from flow import RateLimit, TailFilter, format_size
+from batch import BatchRun, find_sources, format_result, FAIL, ERROR_RESULT
 
 __all__ = ('SMLConsole', 'OutFile')
 
-COPY_DATA_APP_WINDOWS = 'CopyData.exe'
-DATA_UPDATE_DELAY = 250
+CLASSIFY_DELAY = 100    # ms to wait for the rest of a diagnostic
+SEARCH_LIMIT = 200      # History entries Ctrl+Up steps through
+COMPLETION_LIMIT = 100  # Names listed when Tab cannot complete further
+QUEUE_HIGH = 1024 * 1024    # Queued characters at which reading stops
+QUEUE_LOW = 256 * 1024      # and at which it starts again
+HEAD_CHARS = 64 * 1024      # Held back output kept by trim_output()
+TAIL_LINES = 100            # Lines at the end kept by trim_output()
+
+# Moscow ML stops printing what each declaration binds while this is set.
+QUIET_ON = 'Meta.quietdec := true;\n'
+QUIET_OFF = 'Meta.quietdec := false;\n'
+
+COMPLETION_PREFIX = re.compile(u"[A-Za-z][\\w'.]*$")
 
 class SMLConsole(gtk.ScrolledWindow):
 
     __gsignals__ = {
         'grab-focus' : 'override',
+        'status-changed' : (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
     }
 
-    def __init__(self, namespace = {}):
+    def __init__(self, namespace = {}, sessions = None):
         gtk.ScrolledWindow.__init__(self)
 
+        # The interpreter belongs to a session, which the plugin's
+        # session manager may share with the consoles of other windows.
+        self.sessions = sessions
+        if sessions is not None:
+            self.session = sessions.acquire(namespace['window'])
+        else:
+            self.session = Session(datadir = namespace.get('datadir'))
+
+        # Everything registered below is undone by stop().
+        self.resources = Resources(GObjectLoop())
+
         self.set_policy(gtk.POLICY_NEVER, gtk.POLICY_AUTOMATIC)
         self.set_shadow_type(gtk.SHADOW_IN)
         self.view = gtk.TextView()
@@ -59,9 +94,13 @@ class SMLConsole(gtk.ScrolledWindow):
         buffer = self.view.get_buffer()
         self.normal = buffer.create_tag("normal")
         self.error  = buffer.create_tag("error")
+        self.warning = buffer.create_tag("warning")
         self.command = buffer.create_tag("command")
+        self.output_tags = {NORMAL: self.normal, ERROR: self.error, WARNING: self.warning}
 
+        self.rate_limit = RateLimit(0)
         SMLConsoleConfig.add_handler(self.apply_preferences)
+        self.resources.add_cleanup(SMLConsoleConfig.remove_handler, self.apply_preferences)
         self.apply_preferences()
 
         self.__spaces_pattern = re.compile(r'^\s+')
@@ -78,112 +117,322 @@ class SMLConsole(gtk.ScrolledWindow):
         self.history_pos = 0
         self.current_command = ''
         self.namespace['__history__'] = self.history
+        self.search_results = None
+        self.search_shown = None
+
+        # The history of all consoles is kept on disk. It is read in the
+        # background, as it may be long.
+        self.history_source = None
+        try:
+            self.stored_history = shared_history()
+        except (IOError, OSError), e:
+            self.stored_history = None
+        if self.stored_history is not None:
+            self.stored_history.max_entries = SMLConsoleConfig().history_size
+            if self.stored_history.loaded:
+                self.history_loaded()
+            else:
+                self.history_source = self.resources.add_idle(self.__load_history_cb)
+
+        # Only the last scrollback_lines lines are kept in the buffer; the
+        # transcript keeps the rest on disk.
+        try:
+            self.transcript = Transcript()
+        except (IOError, OSError), e:
+            self.transcript = None
+
+        # Output is queued and inserted into the buffer once per frame.
+        self.output = OutputQueue(self.insert_output, self.output_flushed, self.resources)
 
         # Set up hooks for standard output.
         self.stdout = OutFile(self, sys.stdout.fileno(), self.normal)
         self.stderr = OutFile(self, sys.stderr.fileno(), self.error)
 
-        self.sml = None
-        self.kill_sml = False
-        self.start_sml()
-        
-        gobject.timeout_add(DATA_UPDATE_DELAY, self.do_communication)
+        # Interpreter output is tagged by what it is, so errors and
+        # warnings stand out.
+        self.classifier = OutputClassifier()
+        self.classify_source = None
+
+        # Reading from the interpreter stops while the queue is behind,
+        # and output coming faster than the rate limit is held back
+        # until the user decides what to do with it. The interpreter
+        # waits in the meantime.
+        self.behind = False
+        self.paused = False
+        self.unlimited = False
+        self.tail = None
+        self.tail_dropped = 0
+        self.tail_action = None
+        self.flow_sml = None
+        self.pause_keys = ((id(self), 'queue'), (id(self), 'paused'))
+
+        # A quiet reload only shows errors, and a summary once the
+        # request sending the document is done.
+        self.load = None
+        self.load_request = None
+        self.load_started = None
+        self.load_count = 0
+        self.load_done = False
+
+        # What a reload sent only counts as loaded once the request
+        # sending it is done, and the interpreter reported no errors.
+        self.reload_record = None
+        self.reload_errors = False
+        self.reload_done = False
+
+        self.batch = None
+
+        self.stopped = False
+        self.resources.connect(self.session, 'output', self.__session_output_cb)
+        self.resources.connect(self.session, 'notice', self.__session_notice_cb)
+        self.resources.connect(self.session, 'status-changed', self.__session_status_cb)
+        self.resources.connect(self.session, 'request-done', self.__session_request_done_cb)
 
         # Signals
         self.view.connect("key-press-event", self.__key_press_event_cb)
         buffer.connect("mark-set", self.__mark_set_cb)
 
-    def start_sml(self):
-        if self.kill_sml:
-            return
-
-        if self.sml:
-            try:
-                self.sml.kill()
-            except:
-                pass
-            self.sml = None
-
-        startupInfo = None
-        if os.name == 'nt':
-            startupInfo = subprocess.STARTUPINFO()
-            startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    metrics = property(lambda self: self.session.metrics)
 
-        config = SMLConsoleConfig()
-        sml_command = [config.sml_interpreter] + shlex.split(config.sml_flags)
-        self.sml = subprocess.Popen(sml_command,
-                                    stdin  = subprocess.PIPE,
-                                    stdout = subprocess.PIPE,
-                                    stderr = subprocess.STDOUT,
-                                    shell = False,
-                                    startupinfo = startupInfo)
-
-        if os.name != 'nt': # Pipes cannot be set non-blocking on Windows
-            import fcntl
-            fcntl.fcntl(self.sml.stdout.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
-
-    def do_communication(self):
-        try:
-            if os.name == 'nt':
-                # Start a process, which copies what it can from its stdin (MosMLs stdout) to its stdout, then dies.
-                # Doing this since we cannot do a non-blocking read from the stdout on Windows.
-                # We can, however, read all the other process wants to output after it's dead.
-                startupInfo = subprocess.STARTUPINFO()
-                startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                proc = subprocess.Popen(os.path.join(self.namespace['datadir'], COPY_DATA_APP_WINDOWS),
-                                        stdin  = self.sml.stdout,
-                                        stdout = subprocess.PIPE,
-                                        stderr = subprocess.STDOUT,
-                                        shell = False,
-                                        startupinfo = startupInfo)
-                (outd, errd) = proc.communicate()
-                self.stdout.write(outd)
-            else:
-                data = ""
-                while True:
-                    c = self.sml.stdout.read(1)
-                    if c == '': break
-                    data += c
-                self.stdout.write(data)
-        except Exception, e:
-            pass
-
-        if self.sml.poll() is not None:
-            self.start_sml()
-
-        gobject.timeout_add(DATA_UPDATE_DELAY, self.do_communication)
+    def __session_output_cb(self, session, text):
+        if self.tail is not None:
+            self.tail.feed(text)
+            if not session.requests.busy:
+                self.end_tail()
+        else:
+            self.show_output(session, text)
+        # The output finishing the load comes after the request is done.
+        if self.load_done:
+            self.end_load()
+        if self.reload_done:
+            self.end_reload()
+
+    def show_output(self, session, text):
+        self.write_classified(self.classifier.feed(text))
+        if self.classifier.holding and self.classify_source is None:
+            self.classify_source = self.resources.call_later(CLASSIFY_DELAY / 1000.0,
+                                                             self.__classify_timeout_cb)
+
+        if not session.requests.busy:
+            self.unlimited = False
+            self.rate_limit.reset()
+        elif not self.rate_limit.take(len(text)) and not self.unlimited and not self.paused:
+            self.pause_output()
+        if self.output.pending > QUEUE_HIGH and not self.behind:
+            self.behind = True
+            session.pause_output(self.pause_keys[0])
+
+    def __classify_timeout_cb(self):
+        self.classify_source = None
+        self.write_classified(self.classifier.release())
+        return False
 
+    def write_classified(self, segments):
+        for (text, kind) in segments:
+            if kind == ERROR:
+                self.reload_errors = True
+            if self.load is not None:
+                if kind != NORMAL:
+                    self.write(self.load.release(), self.normal)
+                text = self.load.feed(text, kind)
+            self.write(text, self.output_tags[kind])
+
+    def __session_notice_cb(self, session, text):
+        self.write_classified(self.classifier.release())
+        self.write(text, self.normal)
+
+    def __session_request_done_cb(self, session, request):
+        if request is self.load_request:
+            self.load_done = True
+        if self.reload_record is not None and request is self.reload_record[2]:
+            self.reload_done = True
+
+    def __session_status_cb(self, session):
+        if self.load is not None and self.load_request is not None and self.load_request.aborted:
+            self.end_load()
+        if self.reload_record is not None and self.reload_record[2].aborted:
+            self.reload_record = None
+            self.reload_done = False
+        # Whatever was decided about the output of an interpreter that
+        # has gone does not apply to the next one.
+        if (self.paused or self.tail is not None) and session.sml is not self.flow_sml:
+            self.unlimited = False
+            if self.paused:
+                self.end_pause()
+            if self.tail is not None:
+                self.end_tail()
+        self.emit('status-changed')
+
+    def pause_output(self):
+        self.paused = True
+        self.flow_sml = self.session.sml
+        self.output.hold()
+        self.session.pause_output(self.pause_keys[1])
+        self.metrics.count('output.held')
+        self.emit('status-changed')
+
+    def end_pause(self):
+        self.paused = False
+        self.output.resume()
+        self.session.resume_output(self.pause_keys[1])
+        self.emit('status-changed')
+
+    def resume_output(self):
+        """Shows the output held back, and lets the rest through until
+        the interpreter waits for input again."""
+        self.unlimited = True
+        self.end_pause()
+
+    def discard_output(self):
+        """Drops the output held back, and all that follows until the
+        interpreter waits for input again."""
+        dropped = self.output.pending
+        self.output.clear()
+        self.start_tail(0, dropped, 'discarded')
+
+    def trim_output(self):
+        """Keeps the start of the output held back and the end of what
+        follows, and drops everything in between."""
+        dropped = self.output.keep_head(HEAD_CHARS)
+        self.start_tail(TAIL_LINES, dropped, 'left out')
+
+    def start_tail(self, lines, dropped, action):
+        self.tail = TailFilter(lines)
+        self.tail_dropped = dropped
+        self.tail_action = action
+        self.end_pause()
+        self.caught_up()
+
+    def end_tail(self):
+        tail = self.tail
+        self.tail = None
+        self.write('(* %s of output %s. *)\n' % (format_size(self.tail_dropped + tail.dropped),
+                                                  self.tail_action), self.normal)
+        self.write_classified(self.classifier.feed(tail.text()))
+        self.emit('status-changed')
 
     def do_grab_focus(self):
         self.view.grab_focus()
 
+    def status_text(self):
+        session = self.session
+        requests = session.requests
+        if session.reaped:
+            return 'Idle. The interpreter starts again on the next evaluation.'
+        if session.restarting:
+            return 'The interpreter exited. Restarting...'
+        if session.gave_up:
+            return 'The interpreter keeps exiting right after starting.'
+        if self.paused:
+            return 'Output paused — %s pending' % format_size(self.output.pending)
+        if session.sml is None:
+            return 'Stopped'
+        if not requests.ready:
+            return 'Starting the interpreter...'
+        if session.interrupting:
+            return 'Interrupting...'
+        if session.input_congested:
+            return 'Sending input — %s waiting for the interpreter' % \
+                   format_size(session.pending_input_bytes())
+        if self.tail is not None:
+            return 'Evaluating. The output is %s until it finishes.' % self.tail_action
+        if requests.busy:
+            if requests.queued:
+                return 'Evaluating (%d more queued)' % requests.queued
+            return 'Evaluating'
+        if session.interrupt_time is not None:
+            return 'Ready. The interrupt took %s.' % format_duration(session.interrupt_time)
+        last = requests.last
+        if last is not None and last.latency is not None:
+            return 'Ready. The last evaluation took %s.' % format_duration(last.latency)
+        return 'Ready'
+
     def apply_preferences(self, *args):
         config = SMLConsoleConfig()
         self.error.set_property("foreground", config.color_error)
+        self.warning.set_property("foreground", config.color_warning)
         self.command.set_property("foreground", config.color_command)
+        self.scrollback_lines = config.scrollback_lines
+        if getattr(self, 'stored_history', None) is not None:
+            self.stored_history.max_entries = config.history_size
+        self.incremental_reload = config.incremental_reload
+        self.quiet_reload = config.quiet_reload
+        self.rate_limit.set_rate(config.output_rate * 1024)
+        self.unit_cache = None
+        compiler = find_compiler(config.sml_interpreter)
+        if config.unit_cache and compiler:
+            try:
+                self.unit_cache = UnitCache(compiler, config.sml_interpreter, config.sml_flags)
+            except (IOError, OSError), e:
+                pass
+
+    def statistics(self):
+        """Returns the session's statistics, along with those of the
+        output queue and the buffer."""
+        statistics = self.session.statistics()
+        if not statistics:
+            return statistics
+        statistics['counters']['callbacks.flush'] = self.output.scheduled
+        buffer = self.view.get_buffer()
+        statistics['gauges'].update({
+            'buffer.chars': buffer.get_char_count(),
+            'buffer.lines': buffer.get_line_count(),
+            'output.pending-chars': self.output.pending,
+            'output.paused': int(self.session.output_paused),
+        })
+        return statistics
 
     def stop(self):
         self.namespace = None
-        self.kill_sml = True
-        try:
-            self.sml.kill()
-        except:
-            pass
-        self.sml = None
+        self.stopped = True
+        if self.batch is not None:
+            self.batch.stop()
+            self.batch = None
+        self.output.clear()
+        for key in self.pause_keys:
+            self.session.resume_output(key)
+        self.resources.release()
+        self.classify_source = self.history_source = None
+        if self.transcript:
+            self.transcript.close()
+        if self.sessions is not None:
+            self.sessions.release(self.session)
+        else:
+            self.session.stop()
 
     def __key_press_event_cb(self, view, event):
         modifier_mask = gtk.accelerator_get_default_mod_mask()
         event_state = event.state & modifier_mask
 
-        if (event.keyval == gtk.keysyms.c or \
-            event.keyval == gtk.keysyms.d) and \
-            event_state == gtk.gdk.CONTROL_MASK:
-               self.sml.kill()
+        if event.keyval == gtk.keysyms.c and event_state == gtk.gdk.CONTROL_MASK:
+            if self.batch is not None and not self.batch.finished:
+                self.batch.cancel()
+            else:
+                # The interpreter cannot notice the interrupt while it
+                # waits for paused output to be read.
+                if self.paused:
+                    self.discard_output()
+                self.reload_record = None
+                self.reload_done = False
+                self.session.interrupt()
+
+        elif event.keyval == gtk.keysyms.d and event_state == gtk.gdk.CONTROL_MASK:
+            self.session.restart()
+
+        if event.keyval in (gtk.keysyms.b, gtk.keysyms.B) and \
+           event_state == gtk.gdk.CONTROL_MASK | gtk.gdk.SHIFT_MASK:
+            self.run_batch(self.get_command_line())
+            return True
 
-        if event.keyval == gtk.keysyms.r and event_state == gtk.gdk.CONTROL_MASK:
-            document = self.namespace['window'].get_active_document()
-            self.start_sml()
-            self.eval( document.get_text( document.get_start_iter(), document.get_end_iter() ) + "\n", display_command = True )
+        if event.keyval in (gtk.keysyms.f, gtk.keysyms.F) and \
+           event_state == gtk.gdk.CONTROL_MASK | gtk.gdk.SHIFT_MASK:
+            self.search_transcript(self.get_command_line())
+            return True
+
+        elif event.keyval in (gtk.keysyms.r, gtk.keysyms.R) and \
+             event_state & ~gtk.gdk.SHIFT_MASK == gtk.gdk.CONTROL_MASK:
+            # Ctrl+Shift+R always reloads from scratch.
+            self.reload_document(full = event_state & gtk.gdk.SHIFT_MASK)
 
         elif event.keyval == gtk.keysyms.Return and event_state == gtk.gdk.CONTROL_MASK:
             # Get the command
@@ -194,6 +443,7 @@ class SMLConsole(gtk.ScrolledWindow):
             line = buffer.get_text(inp, cur)
             self.current_command = self.current_command + line + "\n"
             self.history_add(line)
+            self.log_input(line + "\n")
 
             # Prepare the new line
             cur = buffer.get_end_iter()
@@ -208,7 +458,7 @@ class SMLConsole(gtk.ScrolledWindow):
                 cur = buffer.get_end_iter()
 
             buffer.place_cursor(cur)
-            gobject.idle_add(self.scroll_to_end)
+            self.queue_scroll()
             return True
 
         elif event.keyval == gtk.keysyms.Return:
@@ -222,6 +472,7 @@ class SMLConsole(gtk.ScrolledWindow):
             line = buffer.get_text(lin, cur)
             self.current_command = self.current_command + line + "\n"
             self.history_add(line)
+            self.log_input(line + "\n")
 
             # Make the line blue
             lin = buffer.get_iter_at_mark(lin_mark)
@@ -231,7 +482,7 @@ class SMLConsole(gtk.ScrolledWindow):
             cur_strip = self.current_command.rstrip()
 
             # Eval the command
-            self.__run(self.current_command)
+            self.__run(self.current_command, interactive = True)
             self.current_command = ''
             self.block_command = False
             com_mark = ""#">>> "
@@ -242,21 +493,33 @@ class SMLConsole(gtk.ScrolledWindow):
             buffer.insert(cur, com_mark)
             cur = buffer.get_end_iter()
             buffer.place_cursor(cur)
-            gobject.idle_add(self.scroll_to_end)
+            self.queue_scroll()
+            return True
+
+        elif event.keyval == gtk.keysyms.Tab and not event_state:
+            return self.complete()
+
+        elif event.keyval in (gtk.keysyms.KP_Up, gtk.keysyms.Up,
+                              gtk.keysyms.KP_Down, gtk.keysyms.Down) and \
+             event_state == gtk.gdk.CONTROL_MASK:
+            # Entries from the stored history containing what was typed
+            view.emit_stop_by_name("key_press_event")
+            self.history_search(event.keyval in (gtk.keysyms.KP_Up, gtk.keysyms.Up))
+            self.queue_scroll()
             return True
 
         elif event.keyval == gtk.keysyms.KP_Down or event.keyval == gtk.keysyms.Down:
             # Next entry from history
             view.emit_stop_by_name("key_press_event")
             self.history_down()
-            gobject.idle_add(self.scroll_to_end)
+            self.queue_scroll()
             return True
 
         elif event.keyval == gtk.keysyms.KP_Up or event.keyval == gtk.keysyms.Up:
             # Previous entry from history
             view.emit_stop_by_name("key_press_event")
             self.history_up()
-            gobject.idle_add(self.scroll_to_end)
+            self.queue_scroll()
             return True
 
         elif event.keyval == gtk.keysyms.KP_Left or event.keyval == gtk.keysyms.Left or \
@@ -317,7 +580,7 @@ class SMLConsole(gtk.ScrolledWindow):
 
     def __mark_set_cb(self, buffer, iter, mark):
         mark_name = mark.get_name()
-        if mark_name in ['input', 'input-line', 'tmp-input-line', None]: return
+        if mark_name in ['input', 'input-line', None]: return
 
         input = buffer.get_iter_at_mark(buffer.get_mark("input-line"))
         pos   = buffer.get_iter_at_mark(buffer.get_insert())
@@ -344,6 +607,88 @@ class SMLConsole(gtk.ScrolledWindow):
             self.history_pos = len(self.history)
             self.history[self.history_pos - 1] = line
             self.history.append('')
+            if self.stored_history is not None:
+                self.stored_history.add(line)
+        self.search_results = None
+
+    def __load_history_cb(self):
+        if self.stored_history.load_step():
+            return True
+        self.history_source = None
+        self.history_loaded()
+        return False
+
+    def history_loaded(self):
+        # The stored history, which includes what was entered here in the
+        # meantime, replaces the list Up and Down step through.
+        behind = len(self.history) - 1 - self.history_pos
+        current = self.history[-1]
+        self.history[:] = self.stored_history.entries
+        self.history.append(current)
+        self.history_pos = max(0, len(self.history) - 1 - behind)
+
+    def history_search(self, backward = True):
+        # Without anything to search for, step through this session's
+        # history as Up and Down do.
+        if self.stored_history is None or \
+           (not self.get_command_line().strip() and self.search_results is None):
+            if backward:
+                self.history_up()
+            else:
+                self.history_down()
+            return
+
+        line = self.get_command_line()
+        if self.search_results is None or line != self.search_shown:
+            self.search_query = line
+            self.search_results = self.stored_history.search(line.decode('utf-8', 'replace'),
+                                                             SEARCH_LIMIT)
+            self.search_pos = -1
+
+        pos = self.search_pos + (backward and 1 or -1)
+        if pos < -1 or pos >= len(self.search_results):
+            return
+        self.search_pos = pos
+        if pos == -1:
+            self.set_command_line(self.search_query)
+        else:
+            self.set_command_line(self.search_results[pos])
+        self.search_shown = self.get_command_line()
+
+    def complete(self):
+        """Completes the name before the cursor from the session's
+        symbol index, or lists the names it could be. Returns False when
+        there is no name, so that Tab is inserted."""
+        buffer = self.view.get_buffer()
+        inp = buffer.get_iter_at_mark(buffer.get_mark("input-line"))
+        cur = buffer.get_iter_at_mark(buffer.get_insert())
+        if cur.compare(inp) < 0:
+            return False
+        m = COMPLETION_PREFIX.search(buffer.get_text(inp, cur).decode('utf-8'))
+        if m is None:
+            return False
+        prefix = m.group()
+
+        # Names from the active document count even before it is loaded,
+        # as it is now; only declarations changed since are looked at.
+        symbols = self.session.symbols
+        document = self.namespace['window'].get_active_document()
+        if document is not None:
+            key = document.get_uri() or id(document)
+            text = document.get_text(document.get_start_iter(), document.get_end_iter())
+            symbols.update_document(key, split_declarations(text))
+
+        names = symbols.complete(prefix, COMPLETION_LIMIT + 1)
+        common = common_prefix(names)
+        if len(common) > len(prefix):
+            buffer.insert(cur, common[len(prefix):])
+        elif len(names) > 1:
+            listed = names[:COMPLETION_LIMIT]
+            if len(names) > COMPLETION_LIMIT:
+                listed.append('...')
+            self.output.write('(* %s *)\n' % ' '.join(listed), self.normal)
+        self.queue_scroll()
+        return True
 
     def history_up(self):
         if self.history_pos > 0:
@@ -357,23 +702,261 @@ class SMLConsole(gtk.ScrolledWindow):
             self.history_pos = self.history_pos + 1
             self.set_command_line(self.history[self.history_pos])
 
+    def queue_scroll(self):
+        self.metrics.count('callbacks.scroll')
+        self.resources.add_idle(self.scroll_to_end)
+
     def scroll_to_end(self):
         iter = self.view.get_buffer().get_end_iter()
         self.view.scroll_to_iter(iter, 0.0)
         return False
 
     def write(self, text, tag = None):
+        if self.transcript:
+            self.transcript.append(text)
+        self.output.write(text, tag)
+
+    def log_input(self, text):
+        if self.transcript:
+            self.transcript.append(text)
+
+    def search_transcript(self, pattern):
+        if self.transcript is None or not pattern.strip():
+            return
+        pattern = pattern.decode('utf-8')
+
+        # Results are not logged, or the next search would find them.
+        matches = self.transcript.search(pattern)
+        result = ['%d matches for "%s" in the transcript:\n' % (len(matches), pattern)]
+        for (line, text) in reversed(matches):
+            result.append('%7d  %s\n' % (line, text))
+        self.output.write(''.join(result), self.normal)
+
+    def run_batch(self, path):
+        """Evaluates the SML files in the directory path, or in that of
+        the active document, each in an interpreter of its own, and
+        reports how each went."""
+        if self.batch is not None and not self.batch.finished:
+            self.output.write('(* A batch run is already going; Ctrl+C stops it. *)\n', self.normal)
+            return
+        path = path.strip()
+        if not path:
+            document = self.namespace['window'].get_active_document()
+            if document is None:
+                return
+            path = document_directory(document)
+        path = os.path.expanduser(path)
+
+        files = find_sources(path)
+        if not files:
+            self.write('(* No SML files in %s. *)\n' % path, self.normal)
+            return
+        config = SMLConsoleConfig()
+        self.batch = BatchRun(files, Session.command(config)[0],
+                              workers = config.batch_workers,
+                              timeout = config.batch_timeout,
+                              memory = config.batch_memory * 1024 * 1024,
+                              result = lambda result: self.batch_result(result, path),
+                              done = self.batch_done,
+                              loop = self.resources)
+        self.write('(* Evaluating %d files in %s with %d interpreters. *)\n' %
+                   (len(files), path, min(len(files), self.batch.workers)), self.normal)
+        self.batch.start()
+
+    def batch_result(self, result, path):
+        if result.status in (FAIL, ERROR_RESULT):
+            tag = self.error
+        else:
+            tag = self.normal
+        self.write('(* %s *)\n' % format_result(result, path), tag)
+        self.queue_scroll()
+
+    def batch_done(self, results):
+        self.write('(* %s. *)\n' % self.batch.summary(), self.normal)
+        self.queue_scroll()
+
+    def insert_output(self, text, tag):
         buffer = self.view.get_buffer()
         if tag is None:
             buffer.insert(buffer.get_end_iter(), text)
         else:
+            # The iter is moved past the inserted text, leaving it where
+            # the input line now starts.
             lin = buffer.get_mark("input-line")
-            m = buffer.create_mark("tmp-input-line", buffer.get_iter_at_mark(lin), False)
-            buffer.insert_with_tags(buffer.get_iter_at_mark(m), text, tag)
-            buffer.move_mark(lin, buffer.get_iter_at_mark(m))
-            buffer.delete_mark(m)
+            iter = buffer.get_iter_at_mark(lin)
+            buffer.insert_with_tags(iter, text, tag)
+            buffer.move_mark(lin, iter)
             self.view.set_editable(True)
-        gobject.idle_add(self.scroll_to_end)
+
+    def output_flushed(self):
+        self.caught_up()
+        self.trim_scrollback()
+        buffer = self.view.get_buffer()
+        self.view.scroll_to_mark(buffer.get_mark("input-end"), 0.0)
+
+    def caught_up(self):
+        if self.behind and self.output.pending < QUEUE_LOW:
+            self.behind = False
+            self.session.resume_output(self.pause_keys[0])
+
+    def trim_scrollback(self):
+        limit = self.scrollback_lines
+        buffer = self.view.get_buffer()
+        lines = buffer.get_line_count()
+        # Trim in batches rather than a few lines on every flush.
+        if limit <= 0 or lines <= limit + limit / 10:
+            return
+
+        end = buffer.get_iter_at_line(lines - limit)
+        input = buffer.get_iter_at_mark(buffer.get_mark("input-line"))
+        if end.compare(input) > 0:
+            end = input
+            end.set_line_offset(0)
+        buffer.delete(buffer.get_start_iter(), end)
+
+    def reload_document(self, full = False):
+        document = self.namespace['window'].get_active_document()
+        if document is None:
+            return
+
+        text = document.get_text(document.get_start_iter(), document.get_end_iter())
+        key = document.get_uri() or id(document)
+        decls = split_declarations(text)
+        self.session.symbols.update_document(key, decls)
+
+        first = None
+        if self.incremental_reload and not full:
+            first = self.session.loaded.first_change(key, decls)
+
+        if first is None:
+            self.session.start('reload')
+            first = 0
+        elif first == len(decls):
+            self.write("(* No changes since the last reload. *)\n", self.normal)
+            return
+        # Otherwise the running interpreter already has everything before
+        # the first changed declaration; the rest shadows what it had.
+        source = self.reload_text(text.decode('utf-8'), decls, first, document) + "\n"
+        if self.quiet_reload:
+            request = self.load_quietly(source, len(decls) - first, document)
+        else:
+            request = self.eval(source, display_command = True)
+        self.reload_record = None
+        self.reload_done = False
+        if not request.aborted:
+            self.reload_record = (key, decls, request)
+            self.reload_errors = False
+
+    def load_quietly(self, source, count, document):
+        """Evaluates source, showing only the errors and warnings it
+        causes, and how many declarations it had and how long they took.
+        Returns the last request the load is sent in."""
+        self.write('(* Loading %s *)\n' % document.get_short_name_for_display(), self.normal)
+        commands = [source]
+        if os.path.basename(self.session.command()[0][0]).lower().startswith('mosml'):
+            commands = [QUIET_ON, source, QUIET_OFF]
+        # Submitting announces status changes, which must not see the
+        # load before the request finishing it is known.
+        self.load_started = time.time()
+        self.load_request = self.eval(commands)
+        self.load = BindingFilter()
+        self.load_count = count
+        self.load_done = False
+        request = self.load_request
+        if request.aborted:
+            self.end_load()
+        return request
+
+    def end_load(self):
+        self.write_classified(self.classifier.release())
+        load = self.load
+        self.load = None
+        self.load_done = False
+        elapsed = format_duration(time.time() - self.load_started)
+        if self.load_request.aborted:
+            summary = '(* The load was cut short after %s. *)\n' % elapsed
+        else:
+            summary = '(* Loaded %d declarations in %s%s. *)\n' % \
+                      (self.load_count, elapsed, load.errors and ', with errors' or '')
+        self.load_request = None
+        self.write(summary, load.errors and self.error or self.normal)
+        self.write(load.release(), self.normal)
+        self.queue_scroll()
+
+    def end_reload(self):
+        self.write_classified(self.classifier.release())
+        (key, decls, request) = self.reload_record
+        self.reload_record = None
+        self.reload_done = False
+        if not request.aborted and not self.reload_errors:
+            self.session.loaded.record(key, decls)
+
+    def reload_text(self, source, decls, first, document):
+        """Returns the source from decls[first] on, with each `use' of a
+        file that has a compiled unit replaced by loading the unit."""
+        if first == 0:
+            start = 0
+        else:
+            start = decls[first].start
+        cache = self.unit_cache
+        if cache is None:
+            return source[start:]
+
+        directory = document_directory(document)
+        pieces = []
+        pos = start
+        dependencies = []
+        jobs = []
+        for decl in decls:
+            if decl.keyword != 'use':
+                continue
+            use = used_file(decl.text)
+            if use is None:
+                break
+            (name, begin, end, terminator) = use
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                path = name
+            try:
+                f = open(path, 'rb')
+                try:
+                    content = f.read()
+                finally:
+                    f.close()
+            except IOError, e:
+                break
+
+            key = cache.key(content, dependencies)
+            # A unit can only be used if all units before it are cached.
+            unit = not jobs and cache.lookup(key)
+            if not unit:
+                jobs.append((key, content, list(dependencies)))
+            elif decl.start >= start:
+                pieces.append(source[pos:decl.start + begin])
+                pieces.append(load_expression(unit, terminator))
+                pos = decl.start + end
+            dependencies.append(key)
+        pieces.append(source[pos:])
+
+        self.compile_units(cache, jobs)
+        return ''.join(pieces)
+
+    def compile_units(self, cache, jobs):
+        # Missing units are compiled one after another in the background
+        # and picked up by the next reload.
+        while jobs and not self.stopped:
+            (key, content, dependencies) = jobs.pop(0)
+            proc = cache.compile(key, content, dependencies)
+            if proc is None:
+                continue
+
+            def compiled(pid, status, cleanup):
+                self.resources.remove_cleanup(cleanup)
+                cache.finished(key, status)
+                self.compile_units(cache, jobs)
+            cleanup = self.resources.add_process(proc)
+            self.resources.watch_child(proc.pid, lambda pid, status: compiled(pid, status, cleanup))
+            return
 
     def eval(self, command, display_command = False):
         buffer = self.view.get_buffer()
@@ -381,34 +964,41 @@ class SMLConsole(gtk.ScrolledWindow):
         buffer.delete(buffer.get_iter_at_mark(lin),
                       buffer.get_end_iter())
 
+        request = None
         if isinstance(command, list) or isinstance(command, tuple):
             for c in command:
                 if display_command:
                     self.write(c + "\n", self.command)
-                self.__run(c)
+                request = self.__run(c)
         else:
             if display_command:
                 self.write(command + "\n", self.command)
-            self.__run(command)
+            request = self.__run(command)
 
         cur = buffer.get_end_iter()
         buffer.move_mark_by_name("input-line", cur)
         cur = buffer.get_end_iter()
         buffer.move_mark_by_name("input-line", cur)
         self.view.scroll_to_iter(cur, 0.0)
+        return request
 
-    def __run(self, command):
-        try:
-            self.sml.stdin.write(command)
-            self.sml.stdin.flush()
-        except Exception, e:
-            print e
-            self.start_sml()
-        return
+    def __run(self, command, interactive = False):
+        return self.session.submit(command, interactive)
 
     def destroy(self):
         pass
 
+def format_duration(seconds):
+    if seconds < 1:
+        return '%d ms' % (seconds * 1000)
+    return '%.1f s' % seconds
+
+def document_directory(document):
+    uri = document.get_uri()
+    if uri and uri.startswith('file://'):
+        return os.path.dirname(urllib.url2pathname(uri[len('file://'):]))
+    return os.getcwd()
+
 class OutFile:
     """A fake output file object. It sends output to a TK test widget,
     and if asked for a file number, returns one set on instance creation"""
@@ -423,8 +1013,8 @@ class OutFile:
     def read(self, a):       return ''
     def readline(self):      return ''
     def readlines(self):     return []
-    def write(self, s):      gobject.idle_add(self.console.write, s, self.tag)
-    def writelines(self, l): gobject.idle_add(self.console.write, l, self.tag)
+    def write(self, s):      self.console.write(s, self.tag)
+    def writelines(self, l): self.console.write(''.join(l), self.tag)
     def seek(self, a):       raise IOError, (29, 'Illegal seek')
     def tell(self):          raise IOError, (29, 'Illegal seek')
     truncate = tell
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# decls.py -- Splitting SML source into top-level declarations
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import hashlib
+import re
+
+__all__ = ('Declaration', 'DeclarationIndex', 'split_declarations')
+
+# Keywords that start a top-level declaration.
+STARTERS = frozenset(['val', 'fun', 'type', 'datatype', 'abstype', 'exception',
+                      'structure', 'signature', 'functor', 'local', 'open',
+                      'infix', 'infixr', 'nonfix'])
+OPENERS = frozenset(['let', 'local', 'struct', 'sig', 'abstype', '(', '[', '{'])
+CLOSERS = frozenset(['end', ')', ']', '}'])
+CONSTRAINTS = frozenset(['where', 'and', 'sharing'])
+# `use' is only a function, but one applied to a file name is taken as
+# a declaration of its own, as it declares whatever the file does.
+USE_FILE = re.compile(r'\s*"')
+
+TOKEN = re.compile(r'''\(\*|"|[A-Za-z0-9_'][A-Za-z0-9_'.]*|[()\[\]{};,]|[!%&$#+\-/:<=>?@\\~`^|*]+''')
+STRING_END = re.compile(r'"|\\.', re.S)
+
+class Declaration(object):
+    """A top-level declaration, or a top-level expression ended by ';'.
+    start and end are offsets into the source it was split from; the
+    text includes any comments and whitespace in front of it."""
+
+    def __init__(self, source, start, end, keyword):
+        self.start = start
+        self.end = end
+        self.text = source[start:end]
+        self.keyword = keyword
+        self.hash = hashlib.sha1(self.text.strip().encode('utf-8')).hexdigest()
+
+    # `use' reads another file, whose contents may have changed even
+    # though the declaration has not.
+    volatile = property(lambda self: self.keyword == 'use')
+
+def skip_comment(source, pos):
+    """Returns the position just after the comment opening at pos."""
+    depth = 0
+    while True:
+        opening = source.find('(*', pos)
+        closing = source.find('*)', pos)
+        if closing < 0:
+            return len(source)
+        if 0 <= opening < closing:
+            depth += 1
+            pos = opening + 2
+        else:
+            depth -= 1
+            pos = closing + 2
+            if depth == 0:
+                return pos
+
+def skip_string(source, pos):
+    """Returns the position just after the string opening at pos."""
+    pos += 1
+    while True:
+        m = STRING_END.search(source, pos)
+        if m is None:
+            return len(source)
+        pos = m.end()
+        if m.group() == '"':
+            return pos
+
+def split_declarations(source):
+    """Splits SML source into its top-level declarations.
+
+    This is a lexical approximation rather than a parser: a declaration
+    ends at a ';' or where a declaration keyword, or `use' followed by a
+    string, appears outside any let/local/struct/sig/abstype ... end or
+    bracket."""
+    if isinstance(source, bytes):
+        source = source.decode('utf-8', 'replace')
+
+    decls = []
+    start = 0           # Start of the current declaration
+    keyword = None      # Its first token
+    depth = 0
+    previous = None
+    pos = 0
+    while True:
+        m = TOKEN.search(source, pos)
+        if m is None:
+            break
+        token = m.group()
+        if token == '(*':
+            pos = skip_comment(source, m.start())
+            continue
+        if token == '"':
+            pos = skip_string(source, m.start())
+            previous = token
+            if keyword is None:
+                keyword = token
+            continue
+        pos = m.end()
+
+        # `datatype t = datatype u' is a replication, not a new declaration,
+        # and `where type', `and type' and `sharing type' are part of a
+        # signature expression.
+        starter = token in STARTERS or (token == 'use' and USE_FILE.match(source, pos))
+        if depth == 0 and starter and keyword is not None and previous != '=' and \
+           not (token == 'type' and previous in CONSTRAINTS):
+            decls.append(Declaration(source, start, m.start(), keyword))
+            start = m.start()
+            keyword = None
+
+        if keyword is None:
+            keyword = token
+
+        if token in OPENERS:
+            depth += 1
+        elif token in CLOSERS:
+            depth = max(0, depth - 1)
+        elif token == ';' and depth == 0:
+            decls.append(Declaration(source, start, pos, keyword))
+            start = pos
+            keyword = None
+        previous = token
+
+    if keyword is not None:
+        decls.append(Declaration(source, start, len(source), keyword))
+    return decls
+
+class DeclarationIndex(object):
+    """Remembers which declarations of a document the running
+    interpreter has been given, so a reload only has to send the
+    declarations from the first changed one onwards."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.document = None
+        self.hashes = []
+
+    def record(self, document, decls):
+        self.document = document
+        self.hashes = [d.hash for d in decls]
+
+    def first_change(self, document, decls):
+        """Returns the index of the first declaration that has to be
+        sent again, or None if the interpreter has not seen this
+        document, or declarations it has seen were deleted from the end.
+        Returns len(decls) if nothing has changed."""
+        if document != self.document or not self.hashes or len(decls) < len(self.hashes):
+            return None
+        for (i, decl) in enumerate(decls):
+            if i >= len(self.hashes) or decl.volatile or decl.hash != self.hashes[i]:
+                return i
+        return len(decls)
+
+# ex:et:ts=4:
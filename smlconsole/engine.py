@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+
+# engine.py -- An interpreter session, without any user interface
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import subprocess
+import time
+
+from reader import PipeReader
+from writer import PipeWriter
+from pool import InterpreterPool
+from decls import DeclarationIndex
+from framing import RequestTracker
+from metrics import Metrics, NULL_METRICS
+from supervisor import RestartSupervisor, exit_cause
+from symbols import SymbolIndex
+from loop import Emitter
+from resources import Resources
+
+__all__ = ('SessionEngine',)
+
+COPY_DATA_APP_WINDOWS = 'CopyData.exe'
+DATA_UPDATE_DELAY = 0.25
+REPLENISH_DELAY = 1.0
+INTERRUPT_TIMEOUT = 3.0     # Seconds to wait for a prompt after an interrupt
+
+class SessionEngine(Emitter):
+    """An interpreter and the state that goes with it: its pipes, the
+    evaluations in flight and the declarations it has been given.
+
+    It runs on the event loop it is given (see loop.GObjectLoop), and
+    everything it registers there is released by stop(). It imports
+    neither GTK nor GObject, so it can be driven from scripts,
+    e.g. through aiosession.AsyncSession. command is the interpreter's
+    command line and transport, as InterpreterProcess takes them.
+
+    Output is announced with the 'output' signal, messages about the
+    session itself, which are not interpreter output, with 'notice',
+    and each finished evaluation with 'request-done'. Output is not
+    read while anyone holds it back with pause_output(). An interpreter
+    that exits is restarted when the supervisor says so, and one
+    stopped by reap() or given up on is restarted by the next submit()."""
+
+    def __init__(self, command, loop, pool = None, datadir = None):
+        Emitter.__init__(self)
+        self.interpreter = command
+        self.loop = Resources(loop)
+
+        # Restarts swap in a standby interpreter from the pool.
+        self.own_pool = pool is None
+        self.pool = pool or InterpreterPool()
+        self.datadir = datadir
+
+        self.metrics = NULL_METRICS
+        self.sml = None
+        self.reader = None
+        self.writer = None
+        self.read_watch = None
+        self.exit_watch = None
+        self.write_watch = None
+        self.output_holds = set()
+        self.poll_source = None
+        self.loaded = DeclarationIndex()
+        self.symbols = SymbolIndex()
+        self.requests = RequestTracker(self.__requests_changed, self.__request_done)
+        self.restart_cause = None
+        self.restart_source = None
+        self.interrupt_sent = None
+        self.interrupt_prompts = 0
+        self.interrupt_source = None
+        self.interrupt_time = None  # How long the last interrupt took
+        self.supervisor = RestartSupervisor()
+        self.started_at = None
+        self.last_active = time.time()
+        self.reaped = False
+        self.stopped = False
+
+    def command(self):
+        return self.interpreter
+
+    def enable_metrics(self, enabled):
+        # With statistics off, NULL_METRICS ignores everything counted.
+        if not enabled:
+            self.metrics = NULL_METRICS
+        elif not self.metrics.enabled:
+            self.metrics = Metrics()
+
+    def start(self, cause = 'startup'):
+        if self.stopped:
+            return
+
+        self.close()
+        self.cancel_restart()
+        self.metrics.count('restarts.' + cause)
+        self.restart_cause = None
+        self.reaped = False
+        self.started_at = self.last_active = time.time()
+        self.loaded.reset()
+        self.symbols.forget_output()
+        self.requests.reset()
+        command, transport = self.command()
+        try:
+            self.sml = self.pool.take(command, transport)
+        except OSError as e:
+            # Most likely the interpreter does not exist.
+            self.after_exit('spawn-error', 0, '%s: %s' % (command[0], e.strerror))
+            return
+        self.loop.call_later(REPLENISH_DELAY, self.pool.replenish, command, transport)
+
+        if os.name != 'nt': # Pipes cannot be set non-blocking on Windows
+            self.reader = PipeReader(self.sml.output_fd, self.output)
+            self.writer = PipeWriter(self.sml.input_fd)
+            self.watch()
+        elif self.poll_source is None: # No fd watches on Windows pipes, so poll instead
+            self.poll_source = self.loop.call_later(DATA_UPDATE_DELAY, self.do_communication)
+
+    def restart(self):
+        """Replaces the interpreter with a new one."""
+        self.start('restart')
+
+    def after_exit(self, cause, uptime, detail = None):
+        """Starts a new interpreter after the last one exited, as soon
+        as the supervisor allows."""
+        if cause == 'interrupt':    # The user asked for it
+            self.start(cause)
+            return
+
+        self.metrics.count('exits.' + cause)
+        delay = self.supervisor.exited(cause, uptime)
+        if delay is None:
+            self.emit('notice', '(* The interpreter exited right after starting %d times in a row, '
+                                'most recently with %s. It will not be restarted until you '
+                                'press Retry or evaluate something; check the interpreter and '
+                                'flags in the preferences. *)\n'
+                                % (self.supervisor.quick_exits, detail or cause))
+        elif delay == 0:
+            self.start(cause)
+            return
+        else:
+            self.emit('notice', '(* The interpreter exited with %s; restarting in %.1f s. *)\n'
+                                % (detail or cause, delay))
+            self.restart_source = self.loop.call_later(delay, self.__restart_cb, cause)
+        self.emit('status-changed')
+
+    def __restart_cb(self, cause):
+        self.restart_source = None
+        self.start(cause)
+        return False
+
+    def cancel_restart(self):
+        if self.restart_source is not None:
+            self.loop.remove(self.restart_source)
+            self.restart_source = None
+
+    def retry(self):
+        """Starts the interpreter now, however often it has exited."""
+        self.supervisor.reset()
+        self.start('retry')
+
+    # Whether the interpreter is down until a restart, or a retry.
+    restarting = property(lambda self: self.restart_source is not None)
+    gave_up = property(lambda self: self.sml is None and self.supervisor.gave_up
+                                    and not self.reaped and not self.stopped)
+
+    def close(self):
+        """Kills the interpreter, if there is one, without starting
+        another."""
+        self.unwatch()
+        self.cancel_interrupt()
+        if self.sml:
+            try:
+                self.sml.kill()
+            except:
+                pass
+            self.sml.close()
+            self.sml = None
+        self.count_pipes()
+
+    def count_pipes(self):
+        # The reader and writer count their own traffic; it is added to
+        # the totals when the interpreter they belong to goes away.
+        if self.reader is not None:
+            self.metrics.count('pipe.bytes-read', self.reader.bytes_read)
+            self.metrics.count('pipe.reads', self.reader.reads)
+            self.reader = None
+        if self.writer is not None:
+            self.metrics.count('pipe.bytes-written', self.writer.bytes_written)
+            self.metrics.count('pipe.writes', self.writer.writes)
+            self.writer = None
+
+    def watch(self):
+        # Output is delivered as soon as it arrives, and the exit of the
+        # interpreter is reported by a child watch, so an idle session
+        # never wakes up.
+        self.exit_watch = self.loop.watch_child(self.sml.pid, self.__exit_cb)
+        if not self.output_holds:
+            self.read_watch = self.loop.add_reader(self.sml.output_fd, self.__output_cb)
+
+    def unwatch(self):
+        for source in (self.read_watch, self.exit_watch, self.write_watch):
+            if source is not None:
+                self.loop.remove(source)
+        self.read_watch = self.exit_watch = self.write_watch = None
+
+    def pause_output(self, key):
+        """Stops reading the interpreter's output until resume_output()
+        is called with the same key, and every other key has been
+        resumed as well. Once the pipe is full, the interpreter blocks."""
+        if not self.output_holds and self.read_watch is not None:
+            self.loop.remove(self.read_watch)
+            self.read_watch = None
+            self.metrics.count('output.pauses')
+        self.output_holds.add(key)
+
+    def resume_output(self, key):
+        self.output_holds.discard(key)
+        if self.output_holds or self.read_watch is not None or self.reader is None:
+            return
+        if self.sml is not None and not self.reader.eof:
+            self.read_watch = self.loop.add_reader(self.sml.output_fd, self.__output_cb)
+
+    output_paused = property(lambda self: bool(self.output_holds))
+
+    def flush_input(self):
+        # Whatever the pipe does not take right away is written once it
+        # becomes writable again, so a large evaluation never blocks.
+        if self.writer.flush() and self.write_watch is None:
+            self.write_watch = self.loop.add_writer(self.sml.input_fd, self.__input_cb)
+
+    def __input_cb(self):
+        congested = self.writer.congested
+        try:
+            if self.writer.flush():
+                if congested and not self.writer.congested:
+                    self.emit('status-changed')
+                return True
+        except OSError as e:
+            # The interpreter went away; the child watch restarts it.
+            pass
+        self.writer.clear()
+        self.write_watch = None
+        if congested:
+            self.emit('status-changed')
+        return False
+
+    def discard_input(self):
+        if self.writer is None:
+            return
+        self.writer.discard()
+        if not self.writer.pending_bytes and self.write_watch is not None:
+            self.loop.remove(self.write_watch)
+            self.write_watch = None
+
+    def pending_input_bytes(self):
+        if self.writer is None:
+            return 0
+        return self.writer.pending_bytes
+
+    input_congested = property(lambda self: self.writer is not None and self.writer.congested)
+
+    def __output_cb(self):
+        try:
+            if self.reader.read():
+                return True
+        except (IOError, OSError) as e:
+            pass
+        # The child watch takes care of restarting the interpreter.
+        self.read_watch = None
+        return False
+
+    def __exit_cb(self, pid, status):
+        if self.sml is None or self.sml.pid != pid:
+            return
+
+        # The child watch has reaped the process already.
+        self.exit_watch = None
+        self.sml.returncode = status
+        self.reader.drain()
+        self.unwatch()
+        self.sml.close()
+        self.sml = None
+        # An interpreter that dies of the interrupt was interrupted all the same.
+        if self.interrupting:
+            self.restart_cause = self.restart_cause or 'interrupt'
+            self.cancel_interrupt()
+        self.after_exit(self.restart_cause or exit_cause(status), time.time() - self.started_at)
+
+    def output(self, text):
+        self.last_active = time.time()
+        self.requests.feed(text)
+        if self.interrupt_sent is not None and self.requests.prompts > self.interrupt_prompts:
+            # A prompt means the interpreter is listening again.
+            self.interrupt_time = time.time() - self.interrupt_sent
+            self.cancel_interrupt()
+            self.metrics.count('interrupts.acknowledged')
+            self.metrics.observe('latency.interrupt', self.interrupt_time)
+            self.emit('status-changed')
+        self.symbols.feed(text)
+        self.emit('output', text)
+
+    def do_communication(self):
+        if self.sml is None:
+            self.poll_source = None
+            return False
+        if not self.output_holds:
+            try:
+                # Start a process, which copies what it can from its stdin (MosMLs stdout) to its stdout, then dies.
+                # Doing this since we cannot do a non-blocking read from the stdout on Windows.
+                # We can, however, read all the other process wants to output after it's dead.
+                startupInfo = subprocess.STARTUPINFO()
+                startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                proc = subprocess.Popen(os.path.join(self.datadir, COPY_DATA_APP_WINDOWS),
+                                        stdin  = self.sml.stdout,
+                                        stdout = subprocess.PIPE,
+                                        stderr = subprocess.STDOUT,
+                                        shell = False,
+                                        startupinfo = startupInfo)
+                (outd, errd) = proc.communicate()
+                self.output(outd.decode('utf-8', 'replace'))
+            except Exception as e:
+                pass
+
+        status = self.sml.poll()
+        if status is not None:
+            self.close()
+            self.after_exit(self.restart_cause or exit_cause(status), time.time() - self.started_at)
+
+        return True
+
+    def submit(self, command, interactive = False):
+        """Sends command to the interpreter, starting one if there is
+        none, and returns the Request tracking it. An interactive
+        command, one the user typed, is refused while the input already
+        queued is congested, and its Request comes back aborted. Others,
+        which follow up on input already sent, are always queued."""
+        if self.sml is None:
+            self.start('respawn')
+            if self.sml is None:
+                # It could not be started; a notice has said why.
+                return self.requests.reject(command)
+        if interactive and self.input_congested:
+            # Queueing more for an interpreter that is not reading would
+            # only grow the backlog without bound.
+            self.emit('notice', '(* The interpreter is not reading its input; %d KB are still '
+                                'waiting to be sent. This was not sent. *)\n'
+                                % (self.writer.pending_bytes // 1024))
+            return self.requests.reject(command)
+        self.last_active = time.time()
+        self.interrupt_time = None
+        request = self.requests.submit(command)
+        try:
+            if self.writer is None: # Windows pipes block
+                data = command
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                self.sml.stdin.write(data)
+                self.sml.stdin.flush()
+            else:
+                self.writer.write(command)
+                self.flush_input()
+                if self.writer.congested:
+                    self.emit('status-changed')
+        except Exception as e:
+            self.start('write-error')
+        return request
+
+    def interrupt(self):
+        """Interrupts the evaluation going on, the way Ctrl+C does in a
+        terminal, which leaves the declarations made so far in place.
+        The interpreter is only killed and restarted if it does not
+        prompt again within INTERRUPT_TIMEOUT seconds, if it cannot be
+        interrupted, or if it is already being interrupted. Input not yet
+        written to the interpreter is dropped, and the requests in
+        flight are aborted."""
+        if self.sml is None:
+            return
+        # How far the evaluation got is unknown, so the next reload
+        # sends everything again.
+        self.loaded.reset()
+        if self.interrupt_sent is not None:
+            self.kill_interrupted('(* The interpreter was restarted, and its declarations are gone. *)\n')
+        elif self.sml.interrupt():
+            self.interrupt_sent = time.time()
+            self.interrupt_prompts = self.requests.prompts
+            # The interpreter is not to go on with input it was given
+            # before the interrupt but has not read yet.
+            self.discard_input()
+            self.requests.abort()
+            self.interrupt_source = self.loop.call_later(INTERRUPT_TIMEOUT, self.__interrupt_timeout_cb)
+            self.emit('status-changed')
+        else:
+            self.kill_interrupted()
+
+    def __interrupt_timeout_cb(self):
+        self.interrupt_source = None
+        self.kill_interrupted('(* The interpreter did not respond to the interrupt within %.0f s, '
+                              'so it was restarted, and its declarations are gone. *)\n'
+                              % INTERRUPT_TIMEOUT)
+        return False
+
+    def kill_interrupted(self, notice = None):
+        self.cancel_interrupt()
+        self.metrics.count('interrupts.killed')
+        if notice:
+            self.emit('notice', notice)
+        self.restart_cause = 'interrupt'
+        self.sml.kill()
+
+    def cancel_interrupt(self):
+        if self.interrupt_source is not None:
+            self.loop.remove(self.interrupt_source)
+            self.interrupt_source = None
+        self.interrupt_sent = None
+
+    interrupting = property(lambda self: self.interrupt_sent is not None)
+
+    def idle_time(self, now = None):
+        """Returns how long the interpreter has been waiting for input,
+        or None if it is busy or not running."""
+        if self.sml is None or self.requests.busy or self.pending_input_bytes():
+            return None
+        return (now or time.time()) - self.last_active
+
+    def reap(self, idle):
+        """Stops the interpreter to free its memory, after it has been
+        idle for idle seconds."""
+        self.close()
+        self.loaded.reset()
+        self.symbols.forget_output()
+        self.requests.reset()
+        self.reaped = True
+        self.metrics.count('reaped')
+        self.emit('notice', '(* The interpreter was stopped after %d minutes without use, '
+                            'and its declarations are gone. '
+                            'It starts again on the next evaluation. *)\n' % (idle / 60))
+        self.emit('status-changed')
+
+    def __requests_changed(self):
+        self.emit('status-changed')
+
+    def __request_done(self, request):
+        self.metrics.observe('latency.first-output', request.first_output - request.submitted)
+        if request.latency is not None:
+            self.metrics.observe('latency.evaluation', request.latency)
+        self.emit('request-done', request)
+
+    def statistics(self):
+        """Returns the collected metrics, along with the traffic of the
+        current interpreter."""
+        if not self.metrics.enabled:
+            return {}
+        statistics = self.metrics.as_dict()
+        counters = statistics['counters']
+        if self.reader is not None:
+            counters['pipe.bytes-read'] = counters.get('pipe.bytes-read', 0) + self.reader.bytes_read
+            counters['pipe.reads'] = counters.get('pipe.reads', 0) + self.reader.reads
+        if self.writer is not None:
+            counters['pipe.bytes-written'] = counters.get('pipe.bytes-written', 0) + self.writer.bytes_written
+            counters['pipe.writes'] = counters.get('pipe.writes', 0) + self.writer.writes
+            statistics['gauges']['input.peak-pending-bytes'] = self.writer.peak_pending_bytes
+        statistics['gauges']['input.pending-bytes'] = self.pending_input_bytes()
+        statistics['gauges']['symbols.names'] = len(self.symbols.sorted)
+        statistics['exits'] = self.supervisor.statistics()
+        return statistics
+
+    def stop(self):
+        self.stopped = True
+        self.cancel_restart()
+        self.close()
+        if self.own_pool:
+            self.pool.clear()
+        self.poll_source = None
+        self.loop.release()
+
+# ex:et:ts=4:
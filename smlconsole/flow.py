@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# flow.py -- Telling runaway output apart, and cutting it down
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from collections import deque
+import time
+
+__all__ = ('RateLimit', 'TailFilter', 'format_size')
+
+BURST = 2.0         # Seconds of output at the full rate allowed at once
+LINE_LIMIT = 1000   # Characters kept of a line in the tail
+
+class RateLimit(object):
+    """Allows rate characters per second on average, with bursts of up
+    to BURST seconds' worth, so that printing a large value goes through
+    and only output that keeps coming is stopped. A rate of 0 allows
+    everything."""
+
+    def __init__(self, rate, clock = time.time):
+        self.clock = clock
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.reset()
+
+    def reset(self):
+        self.allowance = self.rate * BURST
+        self.last = self.clock()
+
+    def take(self, n):
+        """Counts n characters of output, and returns whether they are
+        within the rate."""
+        if not self.rate:
+            return True
+        now = self.clock()
+        self.allowance = min(self.rate * BURST, self.allowance + (now - self.last) * self.rate) - n
+        self.last = now
+        return self.allowance >= 0
+
+class TailFilter(object):
+    """Drops the output fed to it, but for its last lines lines, which
+    text() returns along with the start of a line not yet finished,
+    such as a prompt. Long lines are cut to their last LINE_LIMIT
+    characters."""
+
+    def __init__(self, lines):
+        self.tail = deque(maxlen = lines)
+        self.lines = lines
+        self.partial = u''
+        self.seen = 0
+
+    def feed(self, text):
+        self.seen += len(text)
+        # Only the last lines of each piece can end up in the tail.
+        pieces = (self.partial + text).rsplit(u'\n', self.lines + 1)
+        self.partial = pieces.pop()[-LINE_LIMIT:]
+        if self.lines:
+            for line in pieces[-self.lines:]:
+                self.tail.append(line[-LINE_LIMIT:] + u'\n')
+
+    def text(self):
+        return u''.join(self.tail) + self.partial
+
+    dropped = property(lambda self: self.seen - len(self.text()))
+
+def format_size(chars):
+    """Output sizes are shown in MB, which are near enough to characters."""
+    return '%.1f MB' % (chars / (1024.0 * 1024))
+
+# ex:et:ts=4:
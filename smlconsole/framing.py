@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# framing.py -- Tracking evaluations by the interpreter's prompts
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import re
+import time
+from collections import deque
+
+__all__ = ('Request', 'RequestTracker', 'PROMPT', 'CONTINUATION_PROMPT')
+
+PROMPT = u'-'
+CONTINUATION_PROMPT = u'='
+
+class Request(object):
+    """A piece of input sent to the interpreter. started is when the
+    interpreter got to it, which for a queued request is when the one
+    before it finished."""
+
+    def __init__(self, id, text, lines):
+        self.id = id
+        self.text = text
+        self.lines = lines
+        self.submitted = time.time()
+        self.started = None
+        self.first_output = None
+        self.finished = None
+        self.prompts = 0
+        self.incomplete = False   # Ended at a continuation prompt
+        self.aborted = False
+
+    def __get_latency(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+    latency = property(__get_latency)
+
+class RequestTracker(object):
+    """Matches the interpreter's prompts to the input sent to it.
+
+    The interpreter prints a prompt each time it reads a line: "- " at
+    the start of a phrase and "= " inside one. Since the input is not
+    echoed, the prompts for consecutive lines without output end up
+    next to each other, as in "- = = > val f = fn : int -> int". A
+    request of n lines is therefore done after n more prompts, and the
+    ones after it are queued on the interpreter's stdin until then.
+    The prompt printed on startup only marks the interpreter as ready.
+
+    Prompts are recognised at the start of a line, and at the end of
+    the output when the interpreter stops to wait for input, e.g. after
+    a print without a newline. changed is called whenever the state
+    changes, and done with each request as it finishes."""
+
+    PROMPT_CHARS = re.escape(PROMPT + CONTINUATION_PROMPT)
+    RUN_RE = re.compile(u'(?m)^(?:[%s] )+' % PROMPT_CHARS)
+    TRAILING_RE = re.compile(u'(?:[%s] )+$' % PROMPT_CHARS)
+
+    def __init__(self, changed = None, done = None):
+        self.changed = changed
+        self.done = done
+        self.next_id = 1
+        self.prompts = 0        # Prompts seen, for telling when one is new
+        self.finished = deque(maxlen = 100)
+        self.queue = deque()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything in flight, e.g. after a restart."""
+        for request in self.queue:
+            request.aborted = True
+        self.queue = deque()
+        self.ready = False
+        self.partial = u''      # Start of a line too short to judge yet
+        self.mid_line = False
+        self.after_prompt = False
+        self.notify()
+
+    def abort(self):
+        """Gives up on the requests in flight, e.g. when their input is
+        dropped."""
+        for request in self.queue:
+            request.aborted = True
+        self.queue = deque()
+        self.notify()
+
+    busy = property(lambda self: bool(self.queue))
+    current = property(lambda self: self.queue and self.queue[0] or None)
+    queued = property(lambda self: max(0, len(self.queue) - 1))
+    last = property(lambda self: self.finished and self.finished[-1] or None)
+
+    def submit(self, text):
+        request = Request(self.next_id, text, max(1, text.count('\n')))
+        self.next_id += 1
+        self.queue.append(request)
+        if len(self.queue) == 1 and self.ready:
+            request.started = request.submitted
+        self.notify()
+        return request
+
+    def reject(self, text):
+        """Returns an aborted request for text that could not be sent."""
+        request = Request(self.next_id, text, max(1, text.count('\n')))
+        self.next_id += 1
+        request.aborted = True
+        return request
+
+    def feed(self, text):
+        data = self.partial + text
+        now = time.time()
+        request = self.current
+        if request is not None and request.started is not None and request.first_output is None:
+            request.first_output = now
+
+        # A run of prompts split over two reads continues at the start.
+        runs = [m for m in self.RUN_RE.finditer(data)
+                if m.start() > 0 or not self.mid_line or self.after_prompt]
+        if not runs or runs[-1].end() < len(data):
+            m = self.TRAILING_RE.search(data)
+            if m is not None:
+                runs.append(m)
+
+        changed = False
+        for m in runs:
+            for kind in m.group()[::2]:
+                changed = self.prompt(kind, now) or changed
+        self.after_prompt = bool(runs) and runs[-1].end() == len(data)
+
+        last = data.rfind(u'\n')
+        fragment = data[last + 1:]
+        at_line_start = last >= 0 or not self.mid_line
+        if at_line_start and len(fragment) < 2:
+            self.partial = fragment
+            self.mid_line = False
+        else:
+            self.partial = u''
+            self.mid_line = bool(fragment)
+
+        if changed:
+            self.notify()
+
+    def prompt(self, kind, now):
+        self.prompts += 1
+        if not self.ready:
+            self.ready = True
+            if self.current is not None:
+                self.current.started = now
+            return True
+
+        request = self.current
+        if request is None:
+            return False
+        request.prompts += 1
+        if request.prompts < request.lines:
+            return False
+
+        request.finished = now
+        if request.first_output is None:
+            request.first_output = now
+        request.incomplete = kind == CONTINUATION_PROMPT
+        self.finished.append(self.queue.popleft())
+        if self.queue:
+            self.queue[0].started = now
+        if self.done:
+            self.done(request)
+        return True
+
+    def notify(self):
+        if self.changed:
+            self.changed()
+
+# ex:et:ts=4:
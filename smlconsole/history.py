@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# history.py -- Persistent command history
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+
+__all__ = ('History', 'history_file', 'shared_history')
+
+MAX_ENTRIES = 100000
+LOAD_CHUNK = 256 * 1024     # bytes parsed per load_step()
+REINDEX_AFTER = 1000        # entries added before the index is rebuilt
+
+def history_file():
+    base = os.environ.get('XDG_DATA_HOME') or \
+           os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'gedit-smlconsole', 'history')
+
+def encode(entry):
+    return entry.replace('\\', '\\\\').replace('\n', '\\n') + '\n'
+
+def decode(line):
+    if '\\' not in line:
+        return line
+    return line.replace('\\\\', '\0').replace('\\n', '\n').replace('\0', '\\')
+
+_shared = {}
+
+def shared_history(path = None):
+    """Returns the History for path that all consoles share."""
+    path = path or history_file()
+    if path not in _shared:
+        _shared[path] = History(path)
+    return _shared[path]
+
+class History(object):
+    """Command lines entered in any console, kept in a file that is only
+    ever appended to, one escaped line per entry.
+
+    The file is read in steps by load_step(), so that loading a long
+    history does not hold up the user interface; entries added in the
+    meantime are appended after what is being loaded. When the file has
+    grown a quarter beyond max_entries, it is rewritten with the last
+    max_entries entries.
+
+    search() looks through the distinct entries from the most recent
+    one back. They are indexed as one string, most recent first, so a
+    search is a few calls to str.find however long the history is. The
+    index is rebuilt after REINDEX_AFTER new entries; until then, the
+    new ones are searched one by one. Entries of several lines are only
+    found while they are among those."""
+
+    def __init__(self, path = None, max_entries = MAX_ENTRIES):
+        self.path = path or history_file()
+        self.max_entries = max_entries
+        self.entries = []
+        self.lines = 0              # Entries in the file
+        self.loaded = False
+        self.recent = []            # Entries added since the index was built
+        self.index = None
+        self.out = None
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.source = open(self.path, 'a+b')
+        self.source.seek(0, os.SEEK_END)
+        self.remaining = self.source.tell()
+        self.source.seek(0)
+        self.partial = b''
+        self.out = open(self.path, 'ab')
+
+    def load_step(self):
+        """Reads the next part of the file. Returns True until it has
+        all been read."""
+        if self.loaded:
+            return False
+
+        data = self.source.read(min(LOAD_CHUNK, self.remaining))
+        self.remaining -= len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        loaded = [decode(line.decode('utf-8', 'replace')) for line in lines]
+        self.lines += len(loaded)
+        if not data or self.remaining <= 0:
+            self.source.close()
+            self.source = None
+            self.loaded = True
+
+        # Entries added while loading come after the loaded ones.
+        self.entries = loaded + self.entries
+        self.index = None
+        if self.loaded and self.lines > self.max_entries + self.max_entries / 4:
+            self.compact()
+        return not self.loaded
+
+    def add(self, entry):
+        if isinstance(entry, bytes):
+            entry = entry.decode('utf-8', 'replace')
+        if self.entries and self.entries[-1] == entry:
+            return
+        self.entries.append(entry)
+        self.recent.append(entry)
+        if len(self.recent) > REINDEX_AFTER:
+            self.index = None
+        try:
+            self.out.write(encode(entry).encode('utf-8'))
+            self.out.flush()
+        except (IOError, OSError) as e:
+            pass
+        self.lines += 1
+        if self.loaded and self.lines > self.max_entries + self.max_entries / 4:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the file with the last max_entries entries."""
+        self.entries = self.entries[-self.max_entries:]
+        temp = self.path + '.tmp'
+        try:
+            f = open(temp, 'wb')
+            try:
+                f.write(''.join([encode(entry) for entry in self.entries]).encode('utf-8'))
+            finally:
+                f.close()
+            self.out.close()
+            if os.name == 'nt':
+                os.remove(self.path)
+            os.rename(temp, self.path)
+        except (IOError, OSError) as e:
+            pass
+        self.out = open(self.path, 'ab')
+        self.lines = len(self.entries)
+        self.index = None
+
+    def build_index(self):
+        seen = set()
+        distinct = []
+        for entry in reversed(self.entries):
+            if entry not in seen and '\n' not in entry:
+                seen.add(entry)
+                distinct.append(entry)
+        self.index = u'\n' + u'\n'.join(distinct) + u'\n'
+        self.recent = []
+
+    def search(self, text, limit = 50):
+        """Returns up to limit distinct entries containing text, most
+        recent first, with those starting with it before the others.
+        Empty text gives the most recent entries."""
+        if self.index is None:
+            self.build_index()
+        found = []
+        seen = set()
+        if not text:
+            return self.most_recent(limit)
+        for (needle, prefix) in ((u'\n' + text, True), (text, False)):
+            for entry in reversed(self.recent):
+                if entry not in seen and \
+                   (entry.startswith(text) if prefix else text in entry):
+                    seen.add(entry)
+                    found.append(entry)
+            pos = 0
+            while len(found) < limit:
+                pos = self.index.find(needle, pos)
+                if pos < 0:
+                    break
+                start = self.index.rfind(u'\n', 0, pos + (prefix and 1 or 0)) + 1
+                end = self.index.find(u'\n', pos + len(needle))
+                if end < 0:
+                    end = len(self.index)
+                entry = self.index[start:end]
+                if entry not in seen and end > start:
+                    seen.add(entry)
+                    found.append(entry)
+                pos = max(end, pos + 1)
+        return found[:limit]
+
+    def most_recent(self, limit):
+        found = []
+        seen = set()
+        for entry in reversed(self.recent):
+            if len(found) >= limit:
+                break
+            if entry not in seen:
+                seen.add(entry)
+                found.append(entry)
+        pos = 0
+        while len(found) < limit and pos < len(self.index):
+            end = self.index.find(u'\n', pos)
+            if end < 0:
+                end = len(self.index)
+            entry = self.index[pos:end]
+            if entry and entry not in seen:
+                seen.add(entry)
+                found.append(entry)
+            pos = end + 1
+        return found
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+# ex:et:ts=4:
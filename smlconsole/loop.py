@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# loop.py -- The event loop the session engine runs on
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+__all__ = ('GObjectLoop', 'Emitter')
+
+class GObjectLoop(object):
+    """What the session engine needs of an event loop, on the GLib main
+    loop that gedit runs. aiosession.AsyncioLoop does the same on an
+    asyncio loop.
+
+    Each add_* method returns a source to pass to remove(). As with
+    GLib, a callback keeps being called for as long as it returns True:
+
+        add_reader(fd, callback)    callback() when fd is readable or
+                                    has been closed at the other end
+        add_writer(fd, callback)    callback() when fd is writable
+        call_later(delay, callback, *args)
+                                    callback(*args) after delay seconds,
+                                    and again every delay seconds
+        add_idle(callback, *args)   callback(*args) when there is
+                                    nothing else to do
+        watch_child(pid, callback)  callback(pid, status) once the
+                                    process has exited and been reaped"""
+
+    def __init__(self):
+        import gobject
+        self.gobject = gobject
+
+    def add_reader(self, fd, callback):
+        gobject = self.gobject
+        return gobject.io_add_watch(fd, gobject.IO_IN | gobject.IO_PRI | gobject.IO_HUP | gobject.IO_ERR,
+                                    lambda fd, condition: callback())
+
+    def add_writer(self, fd, callback):
+        gobject = self.gobject
+        return gobject.io_add_watch(fd, gobject.IO_OUT | gobject.IO_HUP | gobject.IO_ERR,
+                                    lambda fd, condition: callback())
+
+    def call_later(self, delay, callback, *args):
+        return self.gobject.timeout_add(int(delay * 1000), callback, *args)
+
+    def add_idle(self, callback, *args):
+        return self.gobject.idle_add(callback, *args)
+
+    def watch_child(self, pid, callback):
+        return self.gobject.child_watch_add(pid, callback)
+
+    def remove(self, source):
+        self.gobject.source_remove(source)
+
+class Emitter(object):
+    """connect(), disconnect() and emit() in the manner of GObject
+    signals, for classes that must work without GObject. A handler is
+    called with the emitter, the arguments of the signal and the extra
+    arguments given to connect()."""
+
+    def __init__(self):
+        self.handlers = []      # [(id, signal, callback, args)]
+        self.next_handler = 1
+
+    def connect(self, signal, callback, *args):
+        handler = self.next_handler
+        self.next_handler += 1
+        self.handlers.append((handler, signal, callback, args))
+        return handler
+
+    def disconnect(self, handler):
+        self.handlers = [entry for entry in self.handlers if entry[0] != handler]
+
+    def emit(self, signal, *args):
+        for (handler, name, callback, extra) in list(self.handlers):
+            if name == signal:
+                callback(self, *(args + extra))
+
+# ex:et:ts=4:
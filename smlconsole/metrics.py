@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# metrics.py -- Counters and histograms for the console's performance
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import json
+import math
+import time
+
+__all__ = ('Histogram', 'Metrics', 'NULL_METRICS', 'dump')
+
+ZERO_BUCKET = -1100     # Below the exponent of any positive float
+
+class Histogram(object):
+    """Counts values in power-of-two buckets; bucket n holds values in
+    [2**(n-1), 2**n), and ZERO_BUCKET holds zero and below."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        bucket = value > 0 and math.frexp(value)[1] or ZERO_BUCKET
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p'th
+        percentile."""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= p * self.count:
+                return min(math.ldexp(1, bucket), self.max)
+        return self.max
+
+    def as_dict(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'buckets': dict((str(math.ldexp(1, b)), n) for (b, n) in self.buckets.items()),
+        }
+
+class Metrics(object):
+    """Named counters, gauges and histograms."""
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def as_dict(self):
+        return {
+            'uptime': time.time() - self.started,
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': dict((name, h.as_dict()) for (name, h) in self.histograms.items()),
+        }
+
+class NullMetrics(object):
+    """Stands in for Metrics when statistics are switched off."""
+
+    enabled = False
+
+    def count(self, name, n = 1):   pass
+    def set(self, name, value):     pass
+    def observe(self, name, value): pass
+    def as_dict(self):              return {}
+
+NULL_METRICS = NullMetrics()
+
+def dump(statistics, path):
+    """Writes statistics, as returned by as_dict(), to path as JSON."""
+    f = open(path, 'w')
+    try:
+        json.dump(statistics, f, indent = 2, sort_keys = True)
+    finally:
+        f.close()
+
+# ex:et:ts=4:
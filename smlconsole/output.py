@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# output.py -- Coalescing queue for console output
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from loop import GObjectLoop
+
+__all__ = ('OutputQueue',)
+
+FRAME_DELAY = 16            # ms between flushes
+FLUSH_BUDGET = 64 * 1024    # characters inserted per flush
+
+class OutputQueue(object):
+    """Collects text written to the console and inserts it in bulk.
+
+    Consecutive writes with the same tag are merged, and the queue is
+    flushed at most once per frame. A flush inserts at most
+    FLUSH_BUDGET characters; anything beyond that waits for the next
+    frame, so the editor stays responsive under heavy output. While
+    held, nothing is inserted, and the output only accumulates."""
+
+    def __init__(self, insert, flushed = None, loop = None):
+        self.insert = insert
+        self.flushed = flushed
+        self.loop = loop or GObjectLoop()
+        self.segments = []
+        self.pending = 0
+        self.source = None
+        self.held = False
+        self.scheduled = 0      # Flushes scheduled
+        self.flushes = 0
+
+    def write(self, text, tag = None):
+        if not text:
+            return
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+
+        if self.segments and self.segments[-1][0] is tag:
+            self.segments[-1][1].append(text)
+        else:
+            self.segments.append((tag, [text]))
+        self.pending += len(text)
+
+        if self.source is None and not self.held:
+            self.schedule()
+
+    def schedule(self):
+        self.source = self.loop.call_later(FRAME_DELAY / 1000.0, self.flush)
+        self.scheduled += 1
+
+    def flush(self):
+        budget = FLUSH_BUDGET
+        self.flushes += 1
+        while self.segments and budget > 0:
+            tag, texts = self.segments[0]
+            text = u''.join(texts)
+            if len(text) > budget:
+                texts[:] = [text[budget:]]
+                text = text[:budget]
+            else:
+                self.segments.pop(0)
+            budget -= len(text)
+            self.pending -= len(text)
+            self.insert(text, tag)
+
+        if self.flushed:
+            self.flushed()
+
+        if self.segments:
+            return True
+        self.source = None
+        return False
+
+    def hold(self):
+        self.held = True
+        if self.source is not None:
+            self.loop.remove(self.source)
+            self.source = None
+
+    def resume(self):
+        self.held = False
+        if self.segments and self.source is None:
+            self.schedule()
+
+    def keep_head(self, limit):
+        """Drops what is queued beyond its first limit characters, cut
+        at the end of a line if there is one, and returns the number of
+        characters dropped."""
+        kept = []
+        size = 0
+        for (tag, texts) in self.segments:
+            text = u''.join(texts)[:limit - size]
+            kept.append((tag, [text]))
+            size += len(text)
+            if size >= limit:
+                end = text.rfind(u'\n') + 1
+                if end:
+                    kept[-1][1][0] = text[:end]
+                    size -= len(text) - end
+                break
+        dropped = self.pending - size
+        self.segments = kept
+        self.pending = size
+        return dropped
+
+    def clear(self):
+        if self.source is not None:
+            self.loop.remove(self.source)
+            self.source = None
+        self.segments = []
+        self.pending = 0
+
+# ex:et:ts=4:
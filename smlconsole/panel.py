@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# panel.py -- Bottom panel item holding the console and its status line
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import gtk
+import pango
+
+from loop import GObjectLoop
+from resources import Resources
+
+__all__ = ('SMLConsolePanel',)
+
+STATISTICS_INTERVAL = 1000  # ms between refreshes of the statistics pane
+
+class SMLConsolePanel(gtk.VBox):
+
+    __gsignals__ = {
+        'grab-focus' : 'override',
+    }
+
+    def __init__(self, create_console):
+        gtk.VBox.__init__(self)
+
+        # The console, and with it the interpreter, is only created once
+        # the panel is first shown or focused.
+        self.create_console = create_console
+        self.console = None
+        self.resources = Resources(GObjectLoop())
+
+        self.status_bar = gtk.HBox(spacing = 6)
+        self.status_bar.set_border_width(2)
+        self.status = gtk.Label()
+        self.status.set_alignment(0.0, 0.5)
+        self.status.set_ellipsize(pango.ELLIPSIZE_END)
+        self.status_bar.pack_start(self.status, True, True)
+        self.retry_button = gtk.Button('Retry')
+        self.retry_button.set_relief(gtk.RELIEF_NONE)
+        self.retry_button.set_focus_on_click(False)
+        self.retry_button.set_tooltip_text('Start the interpreter now')
+        self.retry_button.connect('clicked', self.__retry_cb)
+        self.status_bar.pack_start(self.retry_button, False, False)
+        # What to do with output that was paused for coming too fast.
+        self.flow_buttons = []
+        for (label, tooltip, callback) in (
+                ('Resume', 'Show the output, and let the rest through', self.__resume_cb),
+                ('Discard', 'Drop the output until the evaluation finishes', self.__discard_cb),
+                ('Head and Tail', 'Show only the start and the end of the output', self.__trim_cb)):
+            button = gtk.Button(label)
+            button.set_relief(gtk.RELIEF_NONE)
+            button.set_focus_on_click(False)
+            button.set_tooltip_text(tooltip)
+            button.connect('clicked', callback)
+            self.status_bar.pack_start(button, False, False)
+            self.flow_buttons.append(button)
+        self.statistics_button = gtk.ToggleButton('Statistics')
+        self.statistics_button.set_relief(gtk.RELIEF_NONE)
+        self.statistics_button.set_focus_on_click(False)
+        self.status_bar.pack_end(self.statistics_button, False, False)
+        self.pack_start(self.status_bar, False, False)
+        self.status_bar.show_all()
+        self.statistics_button.hide()
+        self.retry_button.hide()
+        for button in self.flow_buttons:
+            button.hide()
+        self.status.set_text('Not started')
+
+        # The statistics pane is only refreshed while it is shown.
+        self.statistics_pane = gtk.HBox(spacing = 6)
+        self.statistics_pane.set_border_width(2)
+        self.statistics = gtk.Label()
+        self.statistics.set_alignment(0.0, 0.0)
+        self.statistics.set_selectable(True)
+        self.statistics.modify_font(pango.FontDescription('Monospace'))
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolled.set_size_request(-1, 120)
+        scrolled.add_with_viewport(self.statistics)
+        self.statistics_pane.pack_start(scrolled, True, True)
+        save = gtk.Button('Save as JSON...')
+        save.connect('clicked', self.__save_statistics_cb)
+        buttons = gtk.VBox()
+        buttons.pack_start(save, False, False)
+        self.statistics_pane.pack_start(buttons, False, False)
+        self.pack_start(self.statistics_pane, False, False)
+        self.statistics_source = None
+
+        self.statistics_button.connect('toggled', self.__statistics_toggled_cb)
+        self.connect('map', self.__map_cb)
+
+    def start(self):
+        if self.console is not None or self.create_console is None:
+            return
+        console = self.console = self.create_console()
+        self.pack_start(console, True, True)
+        self.reorder_child(console, 0)
+        console.show()
+        self.resources.connect(console, 'status-changed', self.__status_changed_cb)
+        self.__status_changed_cb(console)
+
+    def __map_cb(self, panel):
+        self.start()
+
+    def do_grab_focus(self):
+        self.start()
+        if self.console is not None:
+            self.console.grab_focus()
+
+    def __status_changed_cb(self, console):
+        self.status.set_text(console.status_text())
+        if console.session.restarting or console.session.gave_up:
+            self.retry_button.show()
+        else:
+            self.retry_button.hide()
+        for button in self.flow_buttons:
+            button.set_property('visible', console.paused)
+        if console.metrics.enabled:
+            self.statistics_button.show()
+        else:
+            self.statistics_button.set_active(False)
+            self.statistics_button.hide()
+
+    def __retry_cb(self, button):
+        self.console.session.retry()
+
+    def __resume_cb(self, button):
+        self.console.resume_output()
+
+    def __discard_cb(self, button):
+        self.console.discard_output()
+
+    def __trim_cb(self, button):
+        self.console.trim_output()
+
+    def __statistics_toggled_cb(self, button):
+        if button.get_active():
+            self.update_statistics()
+            self.statistics_pane.show_all()
+            if self.statistics_source is None:
+                self.statistics_source = self.resources.call_later(STATISTICS_INTERVAL / 1000.0,
+                                                                   self.update_statistics)
+        else:
+            self.statistics_pane.hide()
+            if self.statistics_source is not None:
+                self.resources.remove(self.statistics_source)
+                self.statistics_source = None
+
+    def update_statistics(self):
+        self.statistics.set_text(format_statistics(self.console.statistics()))
+        return True
+
+    def __save_statistics_cb(self, button):
+        from metrics import dump
+
+        dialog = gtk.FileChooserDialog('Save Statistics', self.get_toplevel(),
+                                       gtk.FILE_CHOOSER_ACTION_SAVE,
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                                        gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name('smlconsole-statistics.json')
+        try:
+            if dialog.run() == gtk.RESPONSE_OK:
+                try:
+                    dump(self.console.statistics(), dialog.get_filename())
+                except (IOError, OSError), e:
+                    self.console.write('(* Could not save the statistics: %s *)\n' % e,
+                                       self.console.error)
+        finally:
+            dialog.destroy()
+
+    def stop(self):
+        # The closure creating the console refers to the window, which
+        # must not be kept alive by a panel that is going away.
+        self.create_console = None
+        self.resources.release()
+        self.statistics_source = None
+        if self.console is not None:
+            self.console.stop()
+            self.remove(self.console)
+            self.console = None
+
+def format_statistics(statistics):
+    if not statistics:
+        return 'Statistics are switched off.'
+    lines = ['Uptime %.0f s' % statistics['uptime']]
+    for section in ('counters', 'gauges'):
+        for (name, value) in sorted(statistics[section].items()):
+            lines.append('%-28s %12d' % (name, value))
+    for (name, h) in sorted(statistics['histograms'].items()):
+        if not h['count']:
+            continue
+        lines.append('%-28s %12d  mean %.1f ms, p50 %.1f ms, p95 %.1f ms, max %.1f ms' %
+                     (name, h['count'], h['mean'] * 1000, h['p50'] * 1000,
+                      h['p95'] * 1000, h['max'] * 1000))
+    return '\n'.join(lines)
+
+# ex:et:ts=4:
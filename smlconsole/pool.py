@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# pool.py -- Warm standby interpreters
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+from transport import InterpreterProcess
+
+__all__ = ('InterpreterPool',)
+
+class InterpreterPool(object):
+    """Keeps one interpreter started in the background for each command
+    line, so a restart can swap it in instead of waiting for a new one
+    to boot. Whatever the standby interpreter printed while starting up
+    is still waiting in its pipe, so the console shows the usual banner.
+
+    take() hands out the standby interpreter, or starts one if there is
+    none; replenish() should be called a little later to start the next.
+    Nothing is started in the background after clear() until take() is
+    called again."""
+
+    def __init__(self):
+        self.standby = {}
+        self.active = False
+
+    @staticmethod
+    def key(command, transport):
+        return (tuple(command), transport)
+
+    def take(self, command, transport):
+        self.active = True
+        sml = self.standby.pop(self.key(command, transport), None)
+        if sml is not None and sml.poll() is not None:
+            # It died while waiting, most likely because of bad flags.
+            sml.close()
+            sml = None
+        if sml is None:
+            sml = InterpreterProcess(command, transport)
+        return sml
+
+    def replenish(self, command, transport):
+        key = self.key(command, transport)
+        if self.active and key not in self.standby:
+            try:
+                self.standby[key] = InterpreterProcess(command, transport)
+            except OSError as e:
+                # The next take() tries again, and reports it.
+                pass
+        return False
+
+    def retain(self, command, transport):
+        """Drops standby interpreters for any other command line, e.g.
+        after the interpreter path or flags have been changed."""
+        key = self.key(command, transport)
+        for other in list(self.standby.keys()):
+            if other != key:
+                self.discard(other)
+
+    def discard(self, key):
+        sml = self.standby.pop(key)
+        try:
+            sml.kill()
+            sml.proc.wait()
+        except OSError:
+            pass
+        sml.close()
+
+    def clear(self):
+        self.active = False
+        for key in list(self.standby.keys()):
+            self.discard(key)
+
+# ex:et:ts=4:
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# reader.py -- Chunked reader for the interpreter's output pipe
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import codecs
+import errno
+import io
+
+__all__ = ('PipeReader',)
+
+BUFFER_SIZE = 256 * 1024
+CHUNK_SIZE = 64 * 1024
+
+class PipeReader(object):
+    """Reads a non-blocking pipe in large chunks into a reusable buffer.
+
+    The data is decoded incrementally as UTF-8, so a character split
+    across two reads comes out whole. Decoded text is handed to the
+    callback in segments ending on a line boundary; a trailing partial
+    line (typically a prompt) is only held back while more data is
+    known to be waiting."""
+
+    def __init__(self, fd, callback, buffer_size = BUFFER_SIZE):
+        self.fd = fd
+        self.callback = callback
+        self.file = io.FileIO(fd, 'r', closefd = False)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.partial = u''
+        self.pending = False
+        self.eof = False
+        self.bytes_read = 0
+        self.reads = 0
+
+    def read(self):
+        """Reads until the pipe would block, reaches end of file or the
+        buffer is full, and passes on what was read. Returns False once
+        end of file has been reached."""
+        if self.eof:
+            return False
+
+        size = len(self.buffer)
+        filled = 0
+        drained = False
+        while filled < size:
+            try:
+                n = self.file.readinto(self.view[filled:filled + CHUNK_SIZE])
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    n = None
+                elif e.errno == errno.EIO: # A pty whose slave side is gone
+                    n = 0
+                else:
+                    raise
+            self.reads += 1
+
+            if n is None:
+                drained = True
+                break
+            if n == 0:
+                self.eof = drained = True
+                break
+            filled += n
+
+        self.bytes_read += filled
+        text = self.partial + self.decoder.decode(self.buffer[:filled], self.eof)
+
+        self.pending = not drained
+        if drained:
+            self.partial = u''
+        else:
+            cut = text.rfind(u'\n') + 1 or len(text)
+            self.partial = text[cut:]
+            text = text[:cut]
+
+        if text:
+            self.callback(text)
+        return not self.eof
+
+    def drain(self):
+        """Reads everything currently available."""
+        while self.read() and self.pending:
+            pass
+
+# ex:et:ts=4:
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# resources.py -- Releasing what a component registered, all at once
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+__all__ = ('Resources',)
+
+class Resources(object):
+    """Keeps track of the timeouts, watches, signal handlers, processes
+    and anything else a component registers, so that release() can undo
+    all of it when the component goes away.
+
+    It has the interface of the loop it wraps (see loop.GObjectLoop),
+    and can be passed wherever a loop is. A source is forgotten when its
+    callback returns False or it is removed. Once released, nothing new
+    is registered, so a callback that was already running cannot leave
+    a timer behind.
+
+    live and wakeups count, over all instances, the sources registered
+    and the callbacks run, for finding leaks."""
+
+    live = 0
+    wakeups = 0
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sources = set()
+        self.cleanups = {}      # Key -> (function, args)
+        self.next_cleanup = 1
+        self.released = False
+
+    def track(self, add, callback, args, once = False):
+        if self.released:
+            return None
+        holder = []
+        def call(*given):
+            Resources.wakeups += 1
+            keep = callback(*(given + args))
+            if (once or not keep) and holder[0] in self.sources:
+                self.sources.discard(holder[0])
+                Resources.live -= 1
+            return keep
+        source = add(call)
+        holder.append(source)
+        self.sources.add(source)
+        Resources.live += 1
+        return source
+
+    def add_reader(self, fd, callback):
+        return self.track(lambda call: self.loop.add_reader(fd, call), callback, ())
+
+    def add_writer(self, fd, callback):
+        return self.track(lambda call: self.loop.add_writer(fd, call), callback, ())
+
+    def call_later(self, delay, callback, *args):
+        return self.track(lambda call: self.loop.call_later(delay, call), callback, args)
+
+    def add_idle(self, callback, *args):
+        return self.track(self.loop.add_idle, callback, args)
+
+    def watch_child(self, pid, callback):
+        return self.track(lambda call: self.loop.watch_child(pid, call), callback, (), once = True)
+
+    def remove(self, source):
+        if source in self.sources:
+            self.sources.discard(source)
+            Resources.live -= 1
+            self.loop.remove(source)
+
+    def add_cleanup(self, function, *args):
+        """Has release() call function(*args). Returns a key for
+        remove_cleanup(), for when it is done with earlier."""
+        if self.released:
+            function(*args)
+            return None
+        key = self.next_cleanup
+        self.next_cleanup += 1
+        self.cleanups[key] = (function, args)
+        return key
+
+    def remove_cleanup(self, key):
+        self.cleanups.pop(key, None)
+
+    def connect(self, emitter, signal, callback, *args):
+        handler = emitter.connect(signal, callback, *args)
+        return self.add_cleanup(emitter.disconnect, handler)
+
+    def add_process(self, proc):
+        """Kills proc on release, unless it has exited by then."""
+        return self.add_cleanup(kill_process, proc)
+
+    def release(self):
+        self.released = True
+        for source in list(self.sources):
+            self.remove(source)
+        for key in sorted(self.cleanups):
+            function, args = self.cleanups.pop(key)
+            function(*args)
+
+def kill_process(proc):
+    if proc.poll() is None:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+        # Reaped here, as its child watch is gone.
+        proc.wait()
+
+# ex:et:ts=4:
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# session.py -- Interpreter sessions shared between consoles
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import shlex
+import time
+
+from config import SMLConsoleConfig
+from pool import InterpreterPool
+from engine import SessionEngine
+from loop import GObjectLoop
+from resources import Resources
+
+__all__ = ('Session', 'SessionManager', 'SESSIONS_SHARED', 'SESSIONS_SEPARATE')
+
+REAP_INTERVAL = 30          # s between checks for idle interpreters
+
+SESSIONS_SEPARATE = 'separate'
+SESSIONS_SHARED = 'shared'
+
+class Session(SessionEngine):
+    """The session engine as the plugin runs it: on the GLib main loop,
+    with the interpreter and statistics the preferences ask for, and
+    following them as they change. The signals are those of
+    SessionEngine."""
+
+    def __init__(self, pool = None, datadir = None):
+        SessionEngine.__init__(self, None, GObjectLoop(), pool, datadir)
+        SMLConsoleConfig.add_handler(self.apply_preferences)
+        self.loop.add_cleanup(SMLConsoleConfig.remove_handler, self.apply_preferences)
+        self.apply_preferences()
+        self.start()
+
+    @staticmethod
+    def command(config = None):
+        config = config or SMLConsoleConfig()
+        return ([config.sml_interpreter] + shlex.split(config.sml_flags),
+                config.sml_transport)
+
+    def apply_preferences(self, *args):
+        if self.stopped:
+            return
+        config = SMLConsoleConfig()
+        self.pool.retain(*self.command(config))
+        self.enable_metrics(config.metrics)
+        self.emit('status-changed')
+
+class SessionManager(object):
+    """Hands out sessions to the consoles of the gedit windows: one
+    shared by all windows, or one for each, as configured. Interpreters
+    idle for longer than the configured timeout are reaped; with no
+    timeout, nothing is checked."""
+
+    def __init__(self, datadir = None):
+        self.datadir = datadir
+        self.pool = InterpreterPool()
+        self.sessions = {}      # Key -> [session, number of consoles]
+        self.resources = None   # While there are sessions
+        self.reap_source = None
+
+    def acquire(self, window):
+        config = SMLConsoleConfig()
+        if config.sml_sessions == SESSIONS_SHARED:
+            key = SESSIONS_SHARED
+        else:
+            key = window
+        if self.resources is None:
+            self.resources = Resources(GObjectLoop())
+            SMLConsoleConfig.add_handler(self.apply_preferences)
+            self.resources.add_cleanup(SMLConsoleConfig.remove_handler, self.apply_preferences)
+            self.apply_preferences()
+        entry = self.sessions.get(key)
+        if entry is None:
+            entry = self.sessions[key] = [Session(self.pool, self.datadir), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def apply_preferences(self, *args):
+        if SMLConsoleConfig().idle_timeout <= 0:
+            if self.reap_source is not None:
+                self.resources.remove(self.reap_source)
+                self.reap_source = None
+        elif self.reap_source is None:
+            self.reap_source = self.resources.call_later(REAP_INTERVAL, self.reap_idle)
+
+    def release(self, session):
+        for (key, entry) in list(self.sessions.items()):
+            if entry[0] is session:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.sessions[key]
+                    session.stop()
+        if not self.sessions:
+            self.pool.clear()
+            if self.resources is not None:
+                self.resources.release()
+                self.resources = None
+                self.reap_source = None
+
+    def reap_idle(self):
+        timeout = SMLConsoleConfig().idle_timeout * 60
+        if timeout <= 0:
+            self.reap_source = None
+            return False
+
+        now = time.time()
+        for (session, users) in self.sessions.values():
+            idle = session.idle_time(now)
+            if idle is not None and idle >= timeout:
+                session.reap(idle)
+
+        # The standby interpreter is dropped along with the last running
+        # one, and started again with it.
+        if all(session.sml is None for (session, users) in self.sessions.values()):
+            self.pool.clear()
+        return True
+
+# ex:et:ts=4:
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# supervisor.py -- Backoff between interpreter restarts
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import random
+import signal
+import time
+
+__all__ = ('RestartSupervisor', 'exit_cause')
+
+STABLE_UPTIME = 10.0    # s an interpreter must run to count as working
+BASE_DELAY = 0.5        # s before the first restart after a quick exit
+MAX_DELAY = 30.0
+MAX_QUICK_EXITS = 5     # Quick exits in a row before giving up
+
+SIGNAL_NAMES = dict((getattr(signal, name), name) for name in dir(signal)
+                    if name.startswith('SIG') and not name.startswith('SIG_'))
+
+def exit_cause(status):
+    """Describes a status from waitpid, or a return code from Popen on
+    Windows, e.g. 'exit-2' or 'SIGSEGV'."""
+    if os.name == 'nt':
+        return 'exit-%d' % status
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        return SIGNAL_NAMES.get(sig, 'signal-%d' % sig)
+    return 'exit-%d' % os.WEXITSTATUS(status)
+
+class RestartSupervisor(object):
+    """Decides how long to wait before restarting an interpreter that
+    has exited.
+
+    An interpreter that ran for STABLE_UPTIME or longer is restarted at
+    once. After each quick exit the delay doubles from BASE_DELAY up to
+    MAX_DELAY, less a random part of up to half, so that the sessions of
+    several windows do not restart in step. After MAX_QUICK_EXITS quick
+    exits in a row it gives up until reset(), as the interpreter will
+    most likely never start with the current preferences."""
+
+    def __init__(self, max_quick_exits = MAX_QUICK_EXITS):
+        self.max_quick_exits = max_quick_exits
+        self.quick_exits = 0
+        self.gave_up = False
+        self.causes = {}        # Cause -> [exits, quick exits, time of the last]
+
+    def exited(self, cause, uptime):
+        """Records an exit and returns the delay in seconds before the
+        next restart, or None to stop restarting."""
+        quick = uptime < STABLE_UPTIME
+        stats = self.causes.setdefault(cause, [0, 0, None])
+        stats[0] += 1
+        stats[1] += quick
+        stats[2] = time.time()
+
+        if not quick:
+            self.reset()
+            return 0.0
+        self.quick_exits += 1
+        if self.quick_exits >= self.max_quick_exits:
+            self.gave_up = True
+            return None
+        delay = min(MAX_DELAY, BASE_DELAY * 2 ** (self.quick_exits - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self):
+        self.quick_exits = 0
+        self.gave_up = False
+
+    def statistics(self):
+        return dict((cause, {'exits': exits, 'quick-exits': quick, 'last': last})
+                    for (cause, (exits, quick, last)) in self.causes.items())
+
+# ex:et:ts=4:
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+# symbols.py -- Names to complete on the command line
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import bisect
+import re
+
+from decls import TOKEN, OPENERS, CLOSERS, skip_comment, skip_string
+
+__all__ = ('SymbolIndex', 'declared_names', 'common_prefix')
+
+# The parts of the Basis Library used most, with their top-level names.
+BASIS_STRUCTURES = {
+    'General': 'exnMessage exnName',
+    'List': 'all app collate concat drop exists filter find foldl foldr getItem hd '
+            'last length map mapPartial nth null partition rev revAppend tabulate take tl',
+    'ListPair': 'all app exists foldl foldr map unzip zip',
+    'Option': 'compose filter getOpt isSome join map mapPartial valOf',
+    'String': 'collate compare concat concatWith explode extract fields implode '
+              'isPrefix isSubstring isSuffix map maxSize size str sub substring '
+              'toCString toString tokens translate fromString',
+    'Substring': 'all base full getc isEmpty size slice string substring tokens triml trimr',
+    'Char': 'chr compare contains isAlpha isAlphaNum isDigit isLower isSpace '
+            'isUpper ord pred succ toLower toString toUpper fromString',
+    'Int': 'abs compare fromString max maxInt min minInt quot rem sign toString',
+    'Real': 'abs ceil compare floor fromInt fromString max min round sign toString trunc',
+    'Math': 'atan cos exp ln pi sin sqrt tan',
+    'Bool': 'fromString not toString',
+    'Array': 'array app foldl foldr fromList length modify sub tabulate update vector',
+    'Vector': 'app concat foldl foldr fromList length map sub tabulate update',
+    'TextIO': 'closeIn closeOut endOfStream flushOut input inputAll inputLine '
+              'openAppend openIn openOut output print stdErr stdIn stdOut',
+    'StringCvt': 'padLeft padRight',
+    'Word': 'andb fromInt orb toInt toString xorb',
+    'Word8': 'fromInt toInt',
+    'CharVector': 'tabulate',
+    'IntInf': 'pow toString',
+    'Time': 'now toMilliseconds toReal toSeconds',
+    'Timer': 'checkCPUTimer checkRealTimer startCPUTimer startRealTimer',
+    'OS': '',
+}
+BASIS_TOP_LEVEL = (
+    # Values
+    'abs app before ceil chr concat explode floor foldl foldr getOpt hd '
+    'ignore implode isSome length map not null ord print real rev round '
+    'size str substring tl trunc valOf vector o use '
+    # Types
+    'array bool char exn int list option order real ref string unit vector word '
+    # Constructors and exceptions
+    'true false nil SOME NONE LESS EQUAL GREATER '
+    'Bind Chr Div Domain Empty Fail Match Option Overflow Size Span Subscript'
+).split()
+
+def basis_names():
+    names = set(BASIS_TOP_LEVEL)
+    for (structure, members) in BASIS_STRUCTURES.items():
+        names.add(structure)
+        names.update(structure + '.' + member for member in members.split())
+    return names
+
+KEYWORDS = frozenset(['abstype', 'and', 'andalso', 'as', 'case', 'datatype', 'do',
+                      'else', 'end', 'eqtype', 'exception', 'fn', 'fun', 'functor',
+                      'handle', 'if', 'in', 'include', 'infix', 'infixr', 'let',
+                      'local', 'nonfix', 'of', 'op', 'open', 'orelse', 'raise', 'rec',
+                      'sharing', 'sig', 'signature', 'struct', 'structure', 'then',
+                      'type', 'val', 'where', 'while', 'with', 'withtype', '_'])
+VALUES = frozenset(['val', 'fun', 'con'])
+TYPES = frozenset(['type', 'eqtype', 'datatype', 'abstype'])
+MODULES = frozenset(['structure', 'signature', 'functor', 'exception'])
+IDENTIFIER = re.compile(u"[A-Za-z][\\w']*$")
+
+def tokens(source):
+    """The tokens of source, leaving out comments and strings."""
+    pos = 0
+    while True:
+        m = TOKEN.search(source, pos)
+        if m is None:
+            return
+        token = m.group()
+        if token == '(*':
+            pos = skip_comment(source, m.start())
+        elif token == '"':
+            pos = skip_string(source, m.start())
+        else:
+            pos = m.end()
+            yield token
+
+def declared_names(source):
+    """Returns the names a declaration binds at its top level: values,
+    types, datatype constructors, exceptions, structures, signatures and
+    functors. Like split_declarations, this is a lexical approximation;
+    names bound inside let, local or struct are left out."""
+    names = []
+    kind = None         # Keyword of the binding being read
+    state = None        # What the next token can be
+    depth = 0
+    in_type = False     # Reading a type annotation in a val pattern
+    for token in tokens(source):
+        if token in OPENERS:
+            depth += 1
+        elif token in CLOSERS:
+            depth = max(0, depth - 1)
+        if depth > 0 and state != 'pattern':
+            continue
+
+        if token == 'and' and kind is not None:
+            state = kind in VALUES and 'pattern' or 'name'
+            in_type = False
+            continue
+        if token in VALUES or token in TYPES or token in MODULES:
+            kind = token
+            state = kind in VALUES and 'pattern' or 'name'
+            in_type = False
+            continue
+
+        if state == 'pattern':
+            # val (a, b : int) = ..., fun f x = ...
+            if token == '=':
+                state = None
+            elif token == ':':
+                in_type = True
+            elif token in (',', ')'):
+                in_type = False
+            elif not in_type and token not in KEYWORDS and IDENTIFIER.match(token) and \
+                 (kind == 'con' or not token[0].isupper()) and token != 'it':
+                names.append(token)
+                if kind == 'fun':
+                    state = None
+        elif state == 'name':
+            if token.startswith("'") or token in ('(', ')', ','):
+                continue        # Type variables
+            if token not in KEYWORDS and IDENTIFIER.match(token):
+                names.append(token)
+            state = kind == 'datatype' and 'equals' or None
+        elif state == 'equals':
+            state = token == '=' and 'constructor' or None
+        elif state == 'constructor':
+            if token == 'datatype':
+                state = None    # datatype t = datatype u
+            elif token != 'op' and IDENTIFIER.match(token) and token not in KEYWORDS:
+                names.append(token)
+                state = 'constructors'
+        elif state == 'constructors':
+            if token == '|':
+                state = 'constructor'
+            elif token == 'withtype':
+                kind = 'type'
+                state = 'name'
+    return names
+
+def common_prefix(names):
+    if not names:
+        return ''
+    first = min(names)
+    last = max(names)
+    for (i, c) in enumerate(first):
+        if i >= len(last) or last[i] != c:
+            return first[:i]
+    return first
+
+# A line of interpreter output that declares something: "> val x = 1 : int"
+# from Moscow ML, "val x = 1 : int" from SML/NJ, and the lines following
+# them. Lines indented further are the members of a structure.
+BINDING = re.compile(u"(?m)^(?:[-=] )*(?:> |  )?"
+                     u"(?:val|con|type|eqtype|datatype|exception|structure|signature|functor) .*$"
+                     u"|^end\\b")
+
+class SymbolIndex(object):
+    """The names that can be completed, kept sorted so that those with
+    a given prefix are found by bisection.
+
+    The names come from the Basis Library, from what the interpreter says
+    it has bound, and from the declarations of each document, which are
+    looked at again only when they change. Each source keeps its own
+    set, and a name is in the sorted list while any set has it."""
+
+    def __init__(self):
+        self.basis = basis_names()
+        self.output = set()
+        self.documents = {}     # Document -> {declaration hash: names}
+        self.document_names = {}
+        self.sorted = sorted(self.basis)
+        self.partial = u''
+        self.in_signature = False
+        self.updates = 0
+
+    def __contains__(self, name):
+        return name in self.basis or name in self.output or \
+               any(name in names for names in self.document_names.values())
+
+    def insert(self, name):
+        i = bisect.bisect_left(self.sorted, name)
+        if i == len(self.sorted) or self.sorted[i] != name:
+            self.sorted.insert(i, name)
+            self.updates += 1
+
+    def discard(self, name):
+        if name in self:
+            return
+        i = bisect.bisect_left(self.sorted, name)
+        if i < len(self.sorted) and self.sorted[i] == name:
+            del self.sorted[i]
+            self.updates += 1
+
+    def add_output_name(self, name):
+        if name not in self.output:
+            self.output.add(name)
+            self.insert(name)
+
+    def feed(self, text):
+        """Takes interpreter output and adds the names it reports bound."""
+        data = self.partial + text
+        end = data.rfind(u'\n') + 1
+        self.partial = data[end:]
+        for m in BINDING.finditer(data, 0, end):
+            line = m.group()
+            if line.startswith(u'end'):
+                self.in_signature = False
+                continue
+            if self.in_signature:
+                continue
+            if line.rstrip().endswith(u'sig'):
+                # SML/NJ lists the members of a structure until "end".
+                self.in_signature = True
+            for name in declared_names(line.lstrip(u'-=> ')):
+                self.add_output_name(name)
+
+    def forget_output(self):
+        """Drops what the interpreter reported, when it is restarted."""
+        output = self.output
+        self.output = set()
+        self.partial = u''
+        self.in_signature = False
+        for name in output:
+            self.discard(name)
+
+    def update_document(self, document, decls):
+        """Takes the declarations of a document, as split_declarations
+        returns them. Only those not seen before are looked at."""
+        old = self.documents.get(document, {})
+        new = {}
+        for decl in decls:
+            if decl.hash not in new:
+                names = old.get(decl.hash)
+                if names is None:
+                    names = declared_names(decl.text)
+                new[decl.hash] = names
+        self.documents[document] = new
+
+        previous = self.document_names.get(document, set())
+        names = set()
+        for declared in new.values():
+            names.update(declared)
+        self.document_names[document] = names
+        for name in names - previous:
+            self.insert(name)
+        for name in previous - names:
+            self.discard(name)
+
+    def complete(self, prefix, limit = 100):
+        """Returns up to limit names starting with prefix, in order."""
+        i = bisect.bisect_left(self.sorted, prefix)
+        found = []
+        while i < len(self.sorted) and len(found) < limit and self.sorted[i].startswith(prefix):
+            found.append(self.sorted[i])
+            i += 1
+        return found
+
+# ex:et:ts=4:
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# transcript.py -- On-disk log of console output
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import bisect
+import mmap
+import os
+import tempfile
+from array import array
+
+__all__ = ('Transcript', 'transcript_dir')
+
+def transcript_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'gedit-smlconsole', 'transcripts')
+
+class Transcript(object):
+    """Everything a console has shown, appended to a file on disk.
+
+    The console only keeps the tail of its output in the text buffer;
+    the transcript keeps all of it. Searches run over a memory map of
+    the file, so trimmed output can be found without reading it back.
+    For every append the byte offset and the number of lines before it
+    are recorded, which lets a match be turned into a line number by
+    counting newlines within a single append."""
+
+    def __init__(self, directory = None):
+        directory = directory or transcript_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, self.path = tempfile.mkstemp(suffix = '.log', dir = directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+        self.lines = 0
+        self.offsets = array('l')
+        self.line_counts = array('l')
+
+    def append(self, text):
+        if not text or self.file is None:
+            return
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+
+        self.offsets.append(self.size)
+        self.line_counts.append(self.lines)
+        self.file.write(text)
+        self.size += len(text)
+        self.lines += text.count(b'\n')
+
+    def search(self, needle, limit = 50):
+        """Returns up to limit (line number, line) pairs containing
+        needle, most recent first."""
+        if not needle or not self.size or self.file is None:
+            return []
+        if not isinstance(needle, bytes):
+            needle = needle.encode('utf-8')
+
+        self.file.flush()
+        results = []
+        f = open(self.path, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), self.size, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            end = self.size
+            while len(results) < limit:
+                pos = mm.rfind(needle, 0, end)
+                if pos < 0:
+                    break
+                start = mm.rfind(b'\n', 0, pos) + 1
+                stop = mm.find(b'\n', pos)
+                if stop < 0:
+                    stop = self.size
+                results.append((self.line_number(mm, start),
+                                mm[start:stop].decode('utf-8', 'replace')))
+                end = start
+        finally:
+            mm.close()
+        return results
+
+    def line_number(self, mm, pos):
+        i = bisect.bisect_right(self.offsets, pos) - 1
+        return self.line_counts[i] + mm[self.offsets[i]:pos].count(b'\n') + 1
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+# ex:et:ts=4:
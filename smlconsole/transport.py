@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# transport.py -- Starting the interpreter on pipes or a pseudo-terminal
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import subprocess
+
+__all__ = ('InterpreterProcess', 'TRANSPORT_PIPE', 'TRANSPORT_PTY', 'TRANSPORTS')
+
+TRANSPORT_PIPE = 'pipe'
+TRANSPORT_PTY = 'pty'
+TRANSPORTS = (TRANSPORT_PIPE, TRANSPORT_PTY)
+
+def pty_supported():
+    try:
+        import pty
+        import termios
+    except ImportError:
+        return False
+    return True
+
+class InterpreterProcess(object):
+    """A running interpreter and the file descriptors used to talk to it.
+
+    With the pipe transport stdin and stdout are separate pipes, with
+    stderr merged into stdout. With the pty transport all three are
+    the slave side of a pseudo-terminal, which makes the interpreter
+    line-buffer its output the way it does in a terminal; input_fd and
+    output_fd are then both the master side. Echo and output
+    post-processing are switched off, so the console sees exactly what
+    the interpreter writes. On POSIX both fds are non-blocking, and the
+    interpreter leads a process group of its own, which interrupt()
+    signals."""
+
+    def __init__(self, command, transport = TRANSPORT_PIPE):
+        if transport == TRANSPORT_PTY and not pty_supported():
+            transport = TRANSPORT_PIPE
+        self.command = command
+        self.transport = transport
+        self.master = None
+
+        if transport == TRANSPORT_PTY:
+            self.proc = self.__spawn_pty(command)
+            self.input_fd = self.output_fd = self.master
+        else:
+            self.proc = self.__spawn_pipe(command)
+            self.input_fd = self.proc.stdin.fileno()
+            self.output_fd = self.proc.stdout.fileno()
+
+        if os.name != 'nt': # Pipes cannot be set non-blocking on Windows
+            import fcntl
+            for fd in set([self.input_fd, self.output_fd]):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    pid = property(lambda self: self.proc.pid)
+    stdin = property(lambda self: self.proc.stdin)
+    stdout = property(lambda self: self.proc.stdout)
+
+    def __get_returncode(self):
+        return self.proc.returncode
+    def __set_returncode(self, value):
+        self.proc.returncode = value
+    returncode = property(__get_returncode, __set_returncode)
+
+    def __spawn_pipe(self, command):
+        startupInfo = None
+        new_session = None
+        if os.name == 'nt':
+            startupInfo = subprocess.STARTUPINFO()
+            startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        else:
+            new_session = os.setsid
+
+        return subprocess.Popen(command,
+                                stdin  = subprocess.PIPE,
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT,
+                                shell = False,
+                                startupinfo = startupInfo,
+                                preexec_fn = new_session)
+
+    def __spawn_pty(self, command):
+        import pty
+        import termios
+
+        self.master, slave = pty.openpty()
+        try:
+            attrs = termios.tcgetattr(slave)
+            attrs[0] &= ~(termios.ICRNL | termios.IXON)
+            attrs[1] &= ~termios.OPOST
+            # Non-canonical input, since canonical mode truncates long lines.
+            attrs[3] &= ~(termios.ECHO | termios.ICANON | termios.ISIG)
+            attrs[6][termios.VMIN] = 1
+            attrs[6][termios.VTIME] = 0
+            termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+            def make_controlling_tty():
+                os.setsid()
+                try:
+                    import fcntl
+                    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+                except (IOError, OSError, AttributeError):
+                    pass
+
+            return subprocess.Popen(command,
+                                    stdin  = slave,
+                                    stdout = slave,
+                                    stderr = slave,
+                                    shell = False,
+                                    close_fds = True,
+                                    preexec_fn = make_controlling_tty)
+        except:
+            os.close(self.master)
+            self.master = None
+            raise
+        finally:
+            os.close(slave)
+
+    def poll(self):
+        return self.proc.poll()
+
+    def interrupt(self):
+        """Sends SIGINT to the interpreter and anything it started, as
+        Ctrl+C in a terminal would. Returns False if it could not, as on
+        Windows."""
+        if os.name == 'nt':
+            return False
+        import signal
+        try:
+            os.killpg(self.proc.pid, signal.SIGINT)
+        except OSError:
+            return False
+        return True
+
+    def kill(self):
+        self.proc.kill()
+
+    def close(self):
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            if pipe is not None:
+                pipe.close()
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+# ex:et:ts=4:
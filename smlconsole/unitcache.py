@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# unitcache.py -- Cache of compiled units for files loaded with `use'
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import hashlib
+import os
+import re
+import shlex
+import subprocess
+
+__all__ = ('UnitCache', 'find_compiler', 'load_expression', 'unit_cache_dir', 'used_file')
+
+MAX_UNITS = 256
+
+USE = re.compile(r'''\buse\s*"((?:[^"\\]|\\[\\"])*)"\s*(;?)(?=\s*$)''')
+
+def unit_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'gedit-smlconsole', 'units')
+
+def find_compiler(interpreter):
+    """Returns the Moscow ML batch compiler belonging to interpreter, or
+    None if the interpreter is not Moscow ML or has no compiler."""
+    directory, name = os.path.split(interpreter)
+    base, ext = os.path.splitext(name)
+    if base != 'mosml':
+        return None
+
+    candidates = [os.path.join(directory, 'mosmlc' + ext)]
+    if not directory:
+        candidates = [os.path.join(d, 'mosmlc' + ext)
+                      for d in os.environ.get('PATH', '').split(os.pathsep)]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+def used_file(text):
+    """If the declaration text is `use "file";', returns the file name,
+    the span of the `use' expression and its terminating ';', if any."""
+    m = USE.search(text)
+    if m is None:
+        return None
+    name = m.group(1).replace('\\"', '"').replace('\\\\', '\\')
+    return (name, m.start(), m.end(), m.group(2))
+
+def load_expression(unit, terminator):
+    return 'load "%s"%s' % (unit.replace('\\', '\\\\').replace('"', '\\"'), terminator)
+
+class UnitCache(object):
+    """Compiled units for source files, keyed by a hash of their
+    contents, the interpreter, its flags and the units they were
+    compiled against.
+
+    Units are compiled in toplevel mode with mosmlc, in the context of
+    the units loaded before them, and named after their key, so a
+    changed file gets a new unit that can be loaded into a running
+    session. compile() only starts the compiler; the caller reports the
+    exit status to finished(). The least recently used units beyond
+    max_units are removed from disk."""
+
+    def __init__(self, compiler, interpreter, flags, directory = None, max_units = MAX_UNITS):
+        self.compiler = compiler
+        self.interpreter = interpreter
+        self.flags = flags
+        self.directory = directory or unit_cache_dir()
+        self.max_units = max_units
+        self.compiling = set()
+        self.failed = set()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, content, dependencies):
+        h = hashlib.sha1()
+        for part in [self.interpreter, self.flags] + list(dependencies):
+            if not isinstance(part, bytes):
+                part = part.encode('utf-8')
+            h.update(part)
+            h.update(b'\0')
+        h.update(content)
+        return h.hexdigest()[:20]
+
+    def path(self, key, ext = ''):
+        return os.path.join(self.directory, 'U' + key + ext)
+
+    def lookup(self, key):
+        """Returns the unit to load for key, or None."""
+        uo = self.path(key, '.uo')
+        if not os.path.exists(uo) or not os.path.exists(self.path(key, '.ui')):
+            return None
+        try:
+            os.utime(uo, None)
+        except OSError:
+            return None
+        return self.path(key)
+
+    def compile(self, key, content, dependencies):
+        if key in self.compiling or key in self.failed or self.lookup(key):
+            return None
+
+        f = open(self.path(key, '.sml'), 'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+
+        log = open(self.path(key, '.log'), 'wb')
+        try:
+            command = [self.compiler, '-c', '-toplevel'] + shlex.split(self.flags) + \
+                      [os.path.basename(self.path(d, '.ui')) for d in dependencies] + \
+                      [os.path.basename(self.path(key, '.sml'))]
+            proc = subprocess.Popen(command, cwd = self.directory,
+                                    stdin = subprocess.PIPE, stdout = log,
+                                    stderr = subprocess.STDOUT)
+            proc.stdin.close()
+        finally:
+            log.close()
+        self.compiling.add(key)
+        return proc
+
+    def finished(self, key, status):
+        self.compiling.discard(key)
+        self.remove(key, ['.sml'])
+        if status != 0 or not self.lookup(key):
+            self.failed.add(key)
+            self.remove(key, ['.ui', '.uo'])
+            return
+        self.remove(key, ['.log'])
+        self.evict()
+
+    def remove(self, key, exts):
+        for ext in exts:
+            try:
+                os.remove(self.path(key, ext))
+            except OSError:
+                pass
+
+    def evict(self):
+        units = []
+        for name in os.listdir(self.directory):
+            if name.startswith('U') and name.endswith('.uo'):
+                path = os.path.join(self.directory, name)
+                units.append((os.path.getmtime(path), name[1:-3]))
+        units.sort()
+        for (mtime, key) in units[:max(0, len(units) - self.max_units)]:
+            self.remove(key, ['.ui', '.uo'])
+
+# ex:et:ts=4:
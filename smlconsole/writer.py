@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# writer.py -- Queued, non-blocking writer for the interpreter's input pipe
+#
+# Copyright (C) 2012 Sebastian Paaske Tørholm
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import errno
+import os
+from collections import deque
+
+__all__ = ('PipeWriter',)
+
+CHUNK_SIZE = 64 * 1024
+HIGH_WATER = 1024 * 1024
+
+class PipeWriter(object):
+    """Queues data for a non-blocking pipe and writes it as the pipe
+    accepts it.
+
+    write() never blocks; flush() writes chunks until the pipe is full
+    and reports whether anything is left, so the caller knows to wait
+    for the pipe to become writable again. pending_bytes is what has
+    been queued but not yet written; the writer is congested while that
+    exceeds high_water."""
+
+    def __init__(self, fd, high_water = HIGH_WATER):
+        self.fd = fd
+        self.high_water = high_water
+        self.queue = deque()
+        self.offset = 0
+        self.pending_bytes = 0
+        self.peak_pending_bytes = 0
+        self.bytes_written = 0
+        self.writes = 0
+
+    congested = property(lambda self: self.pending_bytes > self.high_water)
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if not data:
+            return
+        self.queue.append(data)
+        self.pending_bytes += len(data)
+        self.peak_pending_bytes = max(self.peak_pending_bytes, self.pending_bytes)
+
+    def flush(self):
+        """Writes as much as the pipe accepts. Returns True while data
+        is still pending. Errors other than a full pipe, such as EPIPE
+        when the interpreter has died, are raised."""
+        while self.queue:
+            head = self.queue[0]
+            try:
+                n = os.write(self.fd, memoryview(head)[self.offset:self.offset + CHUNK_SIZE])
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                raise
+            self.writes += 1
+            self.bytes_written += n
+            self.pending_bytes -= n
+            self.offset += n
+            if self.offset == len(head):
+                self.queue.popleft()
+                self.offset = 0
+        return False
+
+    def discard(self):
+        """Drops what is queued, but for the rest of a line already
+        partly written, so that what is written next does not continue
+        half a line."""
+        rest = b''
+        if self.offset:
+            head = self.queue[0]
+            end = head.find(b'\n', self.offset)
+            rest = head[self.offset:end >= 0 and end + 1 or len(head)]
+        self.clear()
+        if rest:
+            self.queue.append(rest)
+            self.pending_bytes = len(rest)
+
+    def clear(self):
+        self.queue.clear()
+        self.offset = 0
+        self.pending_bytes = 0
+
+# ex:et:ts=4: